@@ -0,0 +1,207 @@
+"""
+Reproducible benchmarks of the calculator, sort_sum and gen_pass hot paths.
+
+    python benchmarks/bench.py --save            # run and store results as the baseline of this machine
+    python benchmarks/bench.py                   # run and compare with the stored baseline
+    python benchmarks/bench.py --quick -k sum    # small datasets, only cases containing "sum"
+
+Datasets are generated with fixed seeds, every case reports ops/sec, latency percentiles
+and peak memory (tracemalloc), regressions against the baseline make the exit status non-zero.
+Timings depend on the machine, so the baseline is not committed, comparing without one is an error.
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from ipaddress import IPv4Address, IPv4Network, IPv6Network
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SRC_DIR = ROOT_DIR / "ipcalc"
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+sys.path.insert(0, str(SRC_DIR))
+
+import calculator  # noqa: E402
+import sort_sum  # noqa: E402
+import gen_pass  # noqa: E402
+
+
+SEED = 20230101
+
+
+def gen_prefixes(count: int, seed: int = SEED, v6_share: float = 0.1) -> str:
+    """
+    Generates a network list, one prefix per line
+    :param count: number of prefixes
+    :param seed: random seed
+    :param v6_share: share of IPv6 prefixes
+    :return: str
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        if rnd.random() < v6_share:
+            lines.append(str(IPv6Network((rnd.getrandbits(48) << 80, rnd.randint(32, 64)), strict=False)))
+        else:
+            lines.append(str(IPv4Network((rnd.getrandbits(32), rnd.randint(8, 32)), strict=False)))
+    return "\n".join(lines)
+
+
+def gen_ranges(count: int, seed: int = SEED) -> str:
+    """
+    Generates a list of "first - last" address ranges, one range per line
+    :param count: number of ranges
+    :param seed: random seed
+    :return: str
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        first = rnd.getrandbits(32)
+        last = min(first + rnd.getrandbits(rnd.randint(1, 16)), 2 ** 32 - 1)
+        lines.append(f"{IPv4Address(first)} - {IPv4Address(last)}")
+    return "\n".join(lines)
+
+
+def gen_queries(count: int, seed: int = SEED) -> list[str]:
+    rnd = random.Random(seed)
+    return [f"{IPv4Network((rnd.getrandbits(32), 32)).network_address}/{rnd.randint(8, 30)}" for _ in range(count)]
+
+
+def calc_uncached(query: str):
+    calculator.calc_cache.clear()
+    return calculator.calc_dispatcher(query)
+
+
+def build_cases(sizes: list[int]) -> dict:
+    """
+    :param sizes: numbers of prefixes for sort_sum cases
+    :return: dictionary of case name and (function, repeat)
+    """
+    queries = gen_queries(1000)
+    cases = {
+        "calc_v4_single": (lambda: [calc_uncached(query) for query in queries[:100]], 20),
+        "calc_v6_single": (lambda: calc_uncached("2001:db8:1234::1/48"), 200),
+        "calc_v4_split12": (lambda: calc_uncached("10.0.0.0/8 /20"), 5),
+        "calc_v6_split12": (lambda: calc_uncached("2001:db8::/32 /44"), 5),
+        "gen_pass_max": (lambda: gen_pass.generate_passwords(
+            nums="on", lchar="on", uchar="on", special="on", length="128", quantity="512"), 5),
+    }
+    for size in sizes:
+        data = gen_prefixes(size)
+        repeat = max(1, 100_000 // size)
+        cases[f"sort_{size}"] = (lambda data=data: sort_sum.get_sorted_nets(data), repeat)
+        cases[f"sum_{size}"] = (lambda data=data: sort_sum.sum_nets(data), repeat)
+        ranges = gen_ranges(size)
+        cases[f"sum_ranges_{size}"] = (
+            lambda ranges=ranges: sort_sum.get_out_form(sort_sum.sum_nets(ranges)[0], "range"), repeat)
+
+    def flask_cases():
+        from view import application
+        application.config["TESTING"] = True
+        client = application.test_client()
+        sort_body = {"action": "sum", "output_format": "address_prefix", "user_nets": gen_prefixes(1000)}
+        def get_uncached(url: str):
+            calculator.calc_cache.clear()
+            return client.get(url)
+
+        return {
+            "flask_index": (lambda: get_uncached("/?network=192.168.0.1/24"), 200),
+            "flask_api_split": (lambda: get_uncached("/api/10.0.0.0_16_24"), 50),
+            "flask_sort_sum": (lambda: client.post("/sort_sum", data=sort_body), 20),
+        }
+
+    try:
+        cases.update(flask_cases())
+    except ImportError as error:
+        print(f"skipping flask cases: {error}", file=sys.stderr)
+    return cases
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run_case(func, repeat: int) -> dict[str, float]:
+    """
+    Runs a case repeat times and measures latency, then once more under tracemalloc for peak memory
+    :param func: function without arguments
+    :param repeat: number of timed runs
+    :return: dictionary with results
+    """
+    func()  # warm up
+    gc.collect()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    total = sum(latencies)
+    return {
+        "ops_sec": repeat / total if total else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="keyword", default="", help="run only cases containing this substring")
+    parser.add_argument("--quick", action="store_true", help="only 1k and 100k prefix datasets")
+    parser.add_argument("--save", action="store_true", help="store results as the baseline")
+    parser.add_argument("--baseline", type=Path, default=BASELINE, help="baseline file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="allowed p50 slowdown against the baseline")
+    args = parser.parse_args()
+
+    if not args.save and not args.baseline.exists():
+        print(f"baseline {args.baseline} does not exist, create it with --save", file=sys.stderr)
+        return 2
+    sizes = [1_000, 100_000] if args.quick else [1_000, 100_000, 1_000_000]
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    results = {}
+    regressions = []
+    missing = []
+
+    print(f"{'case':<20}{'ops/sec':>12}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'peak KiB':>12}{'vs base':>10}")
+    for name, (func, repeat) in build_cases(sizes).items():
+        if args.keyword not in name:
+            continue
+        result = run_case(func, repeat)
+        results[name] = result
+        ratio = ""
+        if name in baseline:
+            slowdown = result["p50_ms"] / baseline[name]["p50_ms"]
+            ratio = f"{slowdown:.2f}x"
+            if slowdown > args.threshold:
+                regressions.append(name)
+        elif not args.save:
+            ratio = "no base"
+            missing.append(name)
+        print(f"{name:<20}{result['ops_sec']:>12.2f}{result['p50_ms']:>12.3f}{result['p95_ms']:>12.3f}"
+              f"{result['p99_ms']:>12.3f}{result['peak_kib']:>12.0f}{ratio:>10}")
+
+    if args.save:
+        args.baseline.write_text(json.dumps({**baseline, **results}, indent=2) + "\n")
+        print(f"baseline saved to {args.baseline}")
+    if regressions:
+        print(f"regressions over {args.threshold}x: {', '.join(regressions)}")
+        return 1
+    if missing:
+        print(f"cases missing from the baseline: {', '.join(missing)}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Mixed-traffic load test against a running server, reports tail latency of cheap and heavy requests.
+
+    python ipcalc/main.py --asgi --port 8000               # with CPU_WORKERS > 0 to offload heavy requests
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --duration 30
+
+Cheap clients request /api/<network> for random networks, heavy clients post large sort/sum inputs,
+the interesting number is how much the cheap p99 grows while heavy requests are running.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench import gen_prefixes, percentile  # noqa: E402
+
+
+def cheap_client(url: str, deadline: float, seed: int, latencies: list) -> None:
+    rnd = random.Random(seed)
+    while time.monotonic() < deadline:
+        network = f"10.{rnd.randrange(256)}.{rnd.randrange(256)}.1_{rnd.randint(8, 30)}"
+        start = time.perf_counter()
+        with urllib.request.urlopen(f"{url}/api/{network}") as response:
+            response.read()
+        latencies.append(time.perf_counter() - start)
+
+
+def heavy_client(url: str, deadline: float, seed: int, lines: int, latencies: list) -> None:
+    body = urllib.parse.urlencode({
+        "action": "sum", "output_format": "address_prefix", "user_nets": gen_prefixes(lines, seed),
+    }).encode()
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        with urllib.request.urlopen(f"{url}/sort_sum", data=body) as response:
+            response.read()
+        latencies.append(time.perf_counter() - start)
+
+
+def report(name: str, latencies: list) -> None:
+    if not latencies:
+        print(f"{name:<8}no completed requests")
+        return
+    print(f"{name:<8}{len(latencies):>8}{percentile(latencies, 50) * 1000:>12.1f}"
+          f"{percentile(latencies, 95) * 1000:>12.1f}{percentile(latencies, 99) * 1000:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--cheap", type=int, default=8, help="number of cheap clients")
+    parser.add_argument("--heavy", type=int, default=2, help="number of heavy clients")
+    parser.add_argument("--lines", type=int, default=50000, help="networks per heavy request")
+    args = parser.parse_args()
+
+    deadline = time.monotonic() + args.duration
+    cheap, heavy = [], []
+    threads = [threading.Thread(target=cheap_client, args=(args.url, deadline, seed, cheap))
+               for seed in range(args.cheap)]
+    threads += [threading.Thread(target=heavy_client, args=(args.url, deadline, seed, args.lines, heavy))
+                for seed in range(args.heavy)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"{'':<8}{'requests':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    report("cheap", cheap)
+    report("heavy", heavy)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,60 @@
+from importlib.util import cache_from_source
 from pathlib import Path
-from zipfile import ZipFile
-import os
+from tempfile import TemporaryDirectory
+from zipfile import ZipFile, ZIP_DEFLATED
+import py_compile
+import sys
 
 
 ROOT_DIR = Path(__file__).resolve().parent
 SRC_DIR = ROOT_DIR / "ipcalc"
+COMPILED_TEMPLATES = "compiled_templates"  # loaded by ip_calc_app.get_app when present
 
 
-def archive(drc_dir: Path) -> None:
-    with ZipFile(f'deploy_ipcalc.zip', 'w') as f:
-        os.chdir(drc_dir)
-        [f.write(file.relative_to(drc_dir)) for file in drc_dir.glob('**/*')]
-        os.chdir(drc_dir.parent)
+def _compile_templates(target_dir: Path) -> None:
+    """
+    Compiles Jinja templates to Python modules for jinja2.ModuleLoader
+    :param target_dir: directory for the compiled modules
+    """
+    sys.path.insert(0, str(SRC_DIR))
+    from ip_calc_app import application
+    application.jinja_env.compile_templates(str(target_dir), zip=None, ignore_errors=False)
+
+
+def _write_with_pyc(archive_file: ZipFile, file: Path, arcname: Path, build_dir: Path) -> None:
+    """
+    Writes a Python source and its compiled bytecode in the __pycache__ layout,
+    the bytecode is not validated against source timestamps because zip entries keep them with 2 s precision
+    """
+    archive_file.write(file, arcname)
+    pyc_name = Path(cache_from_source(str(arcname)))
+    pyc_file = build_dir / pyc_name
+    py_compile.compile(str(file), cfile=str(pyc_file), dfile=str(arcname), doraise=True,
+                       invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    archive_file.write(pyc_file, pyc_name)
+
+
+def archive(src_dir: Path, target: Path = ROOT_DIR / "deploy_ipcalc.zip") -> None:
+    """
+    Builds the deployment artifact: sources with .pyc files, static files, templates and compiled templates
+    :param src_dir: application directory
+    :param target: zip file
+    """
+    with TemporaryDirectory() as build_dir, ZipFile(target, 'w', ZIP_DEFLATED) as f:
+        build_dir = Path(build_dir)
+        for file in sorted(src_dir.glob('**/*')):
+            if file.is_dir() or "__pycache__" in file.parts or file.suffix == ".pyc":
+                continue
+            arcname = file.relative_to(src_dir)
+            if file.suffix == ".py":
+                _write_with_pyc(f, file, arcname, build_dir)
+            else:
+                f.write(file, arcname)
+
+        compiled_dir = build_dir / COMPILED_TEMPLATES
+        _compile_templates(compiled_dir)
+        for file in sorted(compiled_dir.glob('*.py')):
+            _write_with_pyc(f, file, Path(COMPILED_TEMPLATES) / file.name, build_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,291 @@
+import gc
+import logging
+import threading
+from typing import Iterable, Iterator
+
+from prefix_trie import _bit, _max_lens
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class _Node:
+    """
+    Node of the compressed trie, a node exists only where a network is stored or where two branches meet.
+    full - the node prefix is covered by the networks stored in its subtree
+    """
+    __slots__ = ("start", "prefixlen", "stored", "full", "parent", "children")
+
+    def __init__(self, start: int, prefixlen: int, parent):
+        self.start = start
+        self.prefixlen = prefixlen
+        self.stored = False
+        self.full = False
+        self.parent = parent
+        self.children = [None, None]
+
+
+def _is_full(node: _Node) -> bool:
+    """
+    :return: True if the node is stored or both its halves are full
+    """
+    if node.stored:
+        return True
+    low, high = node.children
+    return (low is not None and high is not None and low.full and high.full
+            and low.prefixlen == high.prefixlen == node.prefixlen + 1)
+
+
+def _sibling(node: _Node) -> _Node:
+    parent = node.parent
+    return parent.children[1] if parent.children[0] is node else parent.children[0]
+
+
+class Aggregator:
+    """
+    Minimal summary of a changing set of IPv4 and IPv6 networks.
+    Networks are (version, start, prefixlen) tuples as returned by sort_sum.get_sorted_nets,
+    the summary networks are the topmost full nodes of a compressed trie of the stored networks.
+    Adding or withdrawing a network walks one path of the trie, so it takes O(prefix length)
+    plus the number of summary networks that change
+    """
+
+    def __init__(self, nets: Iterable[tuple] = ()):
+        """
+        :param nets: initial (version, start, prefixlen) tuples, they are loaded in one pass
+        """
+        self._roots = {version: None for version in _max_lens}
+        self._lock = threading.RLock()
+        self.size = 0
+        nets = sorted(set(nets))
+        # the cyclic garbage collector would rescan the growing trie many times while it is built
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for version in _max_lens:
+                self._build(version, [(start, prefixlen) for net_version, start, prefixlen in nets
+                                      if net_version == version])
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _build(self, version: int, pairs: list[tuple[int, int]]) -> None:
+        """
+        Builds the trie of one address family from sorted unique networks, keeping a stack of the rightmost path,
+        then marks full nodes bottom-up
+        :param pairs: list of (start, prefixlen) pairs sorted by start, then prefixlen
+        """
+        max_len = _max_lens[version]
+        stack = []
+        for start, prefixlen in pairs:
+            child = None
+            while stack and (stack[-1].prefixlen > prefixlen
+                             or (stack[-1].start ^ start) >> (max_len - stack[-1].prefixlen)):
+                child = stack.pop()
+            parent = stack[-1] if stack else None
+            if child is not None:
+                # the previous network and this one meet below parent, insert a node at the branching point
+                common = max_len - (child.start ^ start).bit_length()
+                if parent is None or common > parent.prefixlen:
+                    branch = _Node(start >> (max_len - common) << (max_len - common) if common else 0, common, parent)
+                    self._link(version, parent, branch, child)
+                    branch.children[_bit(child.start, common, max_len)] = child
+                    child.parent = branch
+                    stack.append(branch)
+                    parent = branch
+            node = _Node(start, prefixlen, parent)
+            node.stored = node.full = True
+            if parent is None:
+                self._roots[version] = node
+            else:
+                parent.children[_bit(start, parent.prefixlen, max_len)] = node
+            stack.append(node)
+        self.size += len(pairs)
+        # children come after their parents in a preorder walk, so the reversed walk visits them first
+        order = []
+        walk = [self._roots[version]] if self._roots[version] is not None else []
+        while walk:
+            node = walk.pop()
+            order.append(node)
+            walk.extend(child for child in node.children if child is not None)
+        for node in reversed(order):
+            node.full = _is_full(node)
+
+    def _link(self, version: int, parent: _Node | None, node: _Node | None, old: _Node | None) -> None:
+        """
+        Replaces the child old of parent with node
+        """
+        if node is not None:
+            node.parent = parent
+        if parent is None:
+            self._roots[version] = node
+        else:
+            parent.children[0 if parent.children[0] is old else 1] = node
+
+    def _find(self, version: int, start: int, prefixlen: int, create: bool) -> _Node | None:
+        """
+        :param create: insert the node if it does not exist
+        :return: node of the network or None if it does not exist
+        """
+        max_len = _max_lens[version]
+        node = self._roots[version]
+        parent = None
+        while node is not None:
+            common = min(max_len - (node.start ^ start).bit_length(), node.prefixlen, prefixlen)
+            if common < node.prefixlen:
+                if not create:
+                    return None
+                # the network branches off inside the node prefix, insert a node at the branching point
+                branch = _Node(start >> (max_len - common) << (max_len - common) if common else 0, common, parent)
+                self._link(version, parent, branch, node)
+                branch.children[_bit(node.start, common, max_len)] = node
+                node.parent = branch
+                if common == prefixlen:
+                    return branch
+                leaf = _Node(start, prefixlen, branch)
+                branch.children[_bit(start, common, max_len)] = leaf
+                return leaf
+            if node.prefixlen == prefixlen:
+                return node
+            parent, node = node, node.children[_bit(start, node.prefixlen, max_len)]
+        if not create:
+            return None
+        leaf = _Node(start, prefixlen, parent)
+        if parent is None:
+            self._roots[version] = leaf
+        else:
+            parent.children[_bit(start, parent.prefixlen, max_len)] = leaf
+        return leaf
+
+    def _prune(self, version: int, node: _Node) -> None:
+        """
+        Removes nodes that are neither stored nor branching, starting from node towards the root
+        """
+        while node is not None and not node.stored:
+            children = [child for child in node.children if child is not None]
+            if len(children) == 2:
+                return
+            parent = node.parent
+            self._link(version, parent, children[0] if children else None, node)
+            if children:
+                return
+            node = parent
+
+    @staticmethod
+    def _top_full(node: _Node, version: int) -> Iterator[tuple]:
+        """
+        Yields the summary networks strictly inside a node that is not full, in address order
+        """
+        stack = [child for child in reversed(node.children) if child is not None]
+        while stack:
+            node = stack.pop()
+            if node.full:
+                yield version, node.start, node.prefixlen
+            else:
+                stack.extend(child for child in reversed(node.children) if child is not None)
+
+    def add(self, net: tuple) -> tuple[list, list]:
+        """
+        Adds a network
+        :param net: (version, start, prefixlen) tuple
+        :return: tuple (summary networks that appeared, summary networks that disappeared)
+        """
+        version, start, prefixlen = net
+        with self._lock:
+            node = self._find(version, start, prefixlen, True)
+            if node.stored:
+                return [], []
+            node.stored = True
+            self.size += 1
+            if node.full:
+                return [], []
+            # a network inside a summary network changes only the full marks under it
+            covered = False
+            ancestor = node.parent
+            while not covered and ancestor is not None:
+                covered = ancestor.full
+                ancestor = ancestor.parent
+            removed = [] if covered else list(self._top_full(node, version))
+            node.full = True
+            # halves that became full together form a larger full network
+            while node.parent is not None and not node.parent.full and _is_full(node.parent):
+                sibling = _sibling(node)
+                removed.append((version, sibling.start, sibling.prefixlen))
+                node = node.parent
+                node.full = True
+            if covered:
+                return [], []
+            return [(version, node.start, node.prefixlen)], sorted(removed)
+
+    def withdraw(self, net: tuple) -> tuple[list, list]:
+        """
+        Withdraws a network, networks that were not added are ignored
+        :param net: (version, start, prefixlen) tuple
+        :return: tuple (summary networks that appeared, summary networks that disappeared)
+        """
+        version, start, prefixlen = net
+        with self._lock:
+            node = self._find(version, start, prefixlen, False)
+            if node is None or not node.stored:
+                return [], []
+            node.stored = False
+            self.size -= 1
+            if _is_full(node):
+                return [], []
+            node.full = False
+            # the path of full nodes from node up, its top is the summary network covering node,
+            # unless a stored network or a full ancestor above covers it
+            path = [node]
+            while path[-1].parent is not None and path[-1].parent.full:
+                ancestor = path[-1].parent
+                if ancestor.stored:
+                    # still covered by a stored network, the summary does not change
+                    self._prune(version, node)
+                    return [], []
+                ancestor.full = False
+                path.append(ancestor)
+            top = path[-1]
+            ancestor = top.parent
+            while ancestor is not None:
+                if ancestor.full:
+                    self._prune(version, node)
+                    return [], []
+                ancestor = ancestor.parent
+            added = [(version, sibling.start, sibling.prefixlen) for sibling in map(_sibling, path[:-1])]
+            added.extend(self._top_full(node, version))
+            self._prune(version, node)
+            return sorted(added), [(version, top.start, top.prefixlen)]
+
+    def update(self, add: Iterable[tuple] = (), withdraw: Iterable[tuple] = ()) -> tuple[list, list]:
+        """
+        Withdraws and then adds networks
+        :param add: (version, start, prefixlen) tuples to add
+        :param withdraw: (version, start, prefixlen) tuples to withdraw
+        :return: tuple (summary networks that appeared, summary networks that disappeared) after all operations
+        """
+        changes = {}
+        with self._lock:
+            for operation, nets in ((self.withdraw, withdraw), (self.add, add)):
+                for net in nets:
+                    added, removed = operation(net)
+                    for summary_net in added:
+                        changes[summary_net] = changes.get(summary_net, 0) + 1
+                    for summary_net in removed:
+                        changes[summary_net] = changes.get(summary_net, 0) - 1
+        return (sorted(net for net, change in changes.items() if change > 0),
+                sorted(net for net, change in changes.items() if change < 0))
+
+    def summary(self) -> list[tuple]:
+        """
+        :return: minimal list of networks covering the stored networks, IPv4 first, then IPv6
+        """
+        result = []
+        with self._lock:
+            for version, root in self._roots.items():
+                if root is not None:
+                    if root.full:
+                        result.append((version, root.start, root.prefixlen))
+                    else:
+                        result.extend(self._top_full(root, version))
+        return result
@@ -0,0 +1,16 @@
+"""
+ASGI entry point, requires asgiref and an ASGI server, for example:
+
+    uvicorn asgi:asgi_app --workers 1
+
+Set CPU_WORKERS in the configuration to offload heavy calculations to a process pool.
+/api/trie indexes and /api/aggregate sessions live in the memory of the server worker that loaded them,
+so run one server worker and scale with CPU_WORKERS, or route every index and session id to the same worker
+with sticky routing. Stateless pages and API endpoints can use any number of server workers.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from view import application
+
+
+asgi_app = WsgiToAsgi(application)
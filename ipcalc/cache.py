@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class LRUCache:
+    """
+    Thread-safe size-bounded LRU cache with TTL eviction and hit/miss counters
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 3600, weigh=None):
+        """
+        :param maxsize: maximum total weight of the entries
+        :param ttl: lifetime of an entry in seconds
+        :param weigh: function that returns the weight of a value, None - every entry weighs 1
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value or default if the key is missing or expired
+        :param key: hashable key
+        :param default: value returned on miss
+        :return: cached value
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value, weight = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.weight -= weight
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value) -> None:
+        """
+        Stores the value, evicting the least recently used entries when the cache is full,
+        a value heavier than maxsize is not stored
+        :param key: hashable key
+        :param value: value to cache
+        """
+        weight = 1 if self.weigh is None else self.weigh(value)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.weight -= old[2]
+            if weight > self.maxsize:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value, weight)
+            self.weight += weight
+            while self.weight > self.maxsize:
+                _, (_, _, evicted_weight) = self._data.popitem(last=False)
+                self.weight -= evicted_weight
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        :return: dictionary with cache counters
+        """
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "weight": self.weight,
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
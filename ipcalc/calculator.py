@@ -1,6 +1,13 @@
 import logging
 import re
-from ipaddress import *
+from bisect import bisect_right
+from socket import inet_ntop, AF_INET6
+from typing import Iterable, Iterator
+from ipaddress import ip_address, ip_network, IPv4Address, IPv4Network, IPv6Address, IPv6Network
+
+import metrics
+from cache import LRUCache
+from workers import offload_map
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -9,6 +16,20 @@ logger.addHandler(logging.NullHandler())
 pref_re = re.compile(r"[\d.]+")
 split_regex = re.compile(r"[\s\/%\\_]+")
 
+subnets_limit = 4096  # maximum number of subnets on one page
+
+bulk_pool_threshold = 1000  # minimum number of bulk queries to fan out to the process pool
+
+
+def _result_weight(result: dict) -> int:
+    """
+    :return: number of network and subnet rows in a calc_dispatcher result, every row takes about 1 KB
+    """
+    return 1 + len(result.get("subnets", ()))
+
+
+calc_cache = LRUCache(maxsize=32768, ttl=3600, weigh=_result_weight)  # at most 32768 rows, about 32 MB
+
 garbage = [
     "mask",
     "маска",
@@ -17,6 +38,8 @@ garbage = [
     "network",
 ]
 
+_garbage_set = frozenset(garbage)
+
 
 def _parse_input(user_string: str) -> tuple:
     """
@@ -25,10 +48,7 @@ def _parse_input(user_string: str) -> tuple:
     :return: tuple with arguments
     """
     parsed_input = split_regex.split(user_string.strip().lower())
-    garbage_in_parsed = set(parsed_input) & set(garbage)
-    if garbage_in_parsed:
-        [parsed_input.remove(some) for some in garbage_in_parsed]
-    return tuple(parsed_input)
+    return tuple(part for part in parsed_input if part not in _garbage_set)
 
 
 def _normalise_subnet_prefix(prefix: str) -> int:
@@ -51,21 +71,228 @@ def _get_doted_binary(packed_address: bytes) -> str:
     :param packed_address: bytes
     :return: str, example "10101100.00010000.00101100.00000001"
     """
-    return '{:08b}.{:08b}.{:08b}.{:08b}'.format(*list(packed_address))
+    first, second, third, fourth = packed_address
+    return f"{_octet_bin[first]}.{_octet_bin[second]}.{_octet_bin[third]}.{_octet_bin[fourth]}"
+
+
+def _int_doted_binary(address: int) -> str:
+    """
+    Converts an integer IPv4 address to a string with a binary representation of the address
+    :param address: int
+    :return: str, example "10101100.00010000.00101100.00000001"
+    """
+    return (f"{_octet_bin[address >> 24]}.{_octet_bin[address >> 16 & 255]}."
+            f"{_octet_bin[address >> 8 & 255]}.{_octet_bin[address & 255]}")
+
+
+def _int_doted_decimal(address: int) -> str:
+    """
+    Converts an integer IPv4 address to a dotted decimal string
+    :param address: int
+    :return: str, example "172.16.44.1"
+    """
+    return f"{address >> 24}.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}"
+
+
+# binary strings of all octets and (netmask_dd, netmask_db, wildcard_dd, wildcard_db) of all IPv4 prefix lengths
+_octet_bin = tuple(f"{octet:08b}" for octet in range(256))
+_v4_masks = tuple(
+    (
+        str(IPv4Address(netmask)),
+        _get_doted_binary(netmask.to_bytes(4, "big")),
+        str(IPv4Address(netmask ^ 0xFFFFFFFF)),
+        _get_doted_binary((netmask ^ 0xFFFFFFFF).to_bytes(4, "big")),
+    )
+    for netmask in ((0xFFFFFFFF << (32 - prefixlen)) & 0xFFFFFFFF for prefixlen in range(33))
+)
+
+
+def _v6_exploded(value: int) -> str:
+    """
+    :param value: integer IPv6 address
+    :return: exploded string, example "2001:0db8:0000:0000:0000:0000:0000:0000"
+    """
+    digits = f"{value:032x}"
+    return (f"{digits[:4]}:{digits[4:8]}:{digits[8:12]}:{digits[12:16]}:"
+            f"{digits[16:20]}:{digits[20:24]}:{digits[24:28]}:{digits[28:]}")
+
+
+def _v6_compressed(value: int) -> str:
+    """
+    :param value: integer IPv6 address
+    :return: compressed string, the same as str(IPv6Address), example "2001:db8::"
+    """
+    if value >> 32 in (0, 0xFFFF):
+        # inet_ntop writes these with an embedded IPv4 address, ipaddress does not
+        return str(IPv6Address(value))
+    return inet_ntop(AF_INET6, value.to_bytes(16, "big"))
 
 
-def _find_subnets(netw: IPv4Network, sub_pfx: int | str) -> dict[str, [str, list]]:
+# (netmask, wildcard) strings of every IPv6 prefix length, exploded and compressed
+_v6_masks = {
+    compressed: tuple(
+        (formatter(0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF ^ hostmask), formatter(hostmask))
+        for hostmask in ((1 << (128 - prefixlen)) - 1 for prefixlen in range(129))
+    )
+    for compressed, formatter in ((False, _v6_exploded), (True, _v6_compressed))
+}
+
+
+def _find_subnets(netw: IPv4Network | IPv6Network, sub_pfx: int, offset: int = 0,
+                  limit: int = subnets_limit, fields: tuple[str] | None = None,
+                  compressed: bool = False) -> dict[str, [str, list]]:
     """
-    Creates a list with subnets and returns a dictionary
+    Creates one page of subnets and returns a dictionary,
+    each subnet is computed directly from its index, so the split depth is not limited
     :param netw: Supernet
     :param sub_pfx: prefix of subnets
+    :param offset: index of the first subnet on the page
+    :param limit: maximum number of subnets on the page
+    :param fields: names of subnet fields to compute, None - all fields
+    :param compressed: IPv6 addresses in compressed notation
     :return: dictionary with subnets
     """
-    if sub_pfx - netw.prefixlen > 12:
-        return {"sub_error": "Sorry, too many subnets, prefix difference cannot be more than 12 bit"}
+    if not netw.prefixlen <= sub_pfx <= netw.max_prefixlen:
+        raise ValueError(f"prefix length diff {sub_pfx - netw.prefixlen} is invalid for netblock {netw}")
+    num_subnets = 1 << (sub_pfx - netw.prefixlen)
+    offset = min(max(offset, 0), num_subnets)
+    limit = min(max(limit, 1), subnets_limit)
+    step = 1 << (netw.max_prefixlen - sub_pfx)
+    start = int(netw.network_address)
+    net_class = netw.__class__
+    indexes = range(offset, min(offset + limit, num_subnets))
+    if fields is None or "type" in fields:
+        types = classify_ranges(netw.version, (
+            (start + index * step, start + (index + 1) * step - 1) for index in indexes
+        ))
+    else:
+        types = [None] * len(indexes)
+    if netw.version == 6:
+        subnets = [
+            _get_v6_info(start + index * step, sub_pfx, fields=fields, net_type=net_type, compressed=compressed)
+            for index, net_type in zip(indexes, types)
+        ]
     else:
-        subnets = [_get_net_info(sub) for sub in netw.subnets(new_prefix=sub_pfx)]
-        return {"num_subnets": len(subnets), "subnets": subnets}
+        subnets = [
+            _get_net_info(net_class((start + index * step, sub_pfx)), fields=fields, net_type=net_type)
+            for index, net_type in zip(indexes, types)
+        ]
+    return {"num_subnets": num_subnets, "subnets": subnets, "offset": offset, "limit": limit}
+
+
+# IANA special-purpose ranges, the same lists the ipaddress properties check
+_special_ranges = {
+    4: {
+        "loopback": ("127.0.0.0/8",),
+        "unspecified": ("0.0.0.0/32",),
+        "reserved": ("240.0.0.0/4",),
+        "multicast": ("224.0.0.0/4",),
+        "link_local": ("169.254.0.0/16",),
+        "shared": ("100.64.0.0/10",),
+        "private": (
+            "0.0.0.0/8", "10.0.0.0/8", "127.0.0.0/8", "169.254.0.0/16", "172.16.0.0/12", "192.0.0.0/29",
+            "192.0.0.170/31", "192.0.2.0/24", "192.168.0.0/16", "198.18.0.0/15", "198.51.100.0/24",
+            "203.0.113.0/24", "240.0.0.0/4", "255.255.255.255/32",
+        ),
+    },
+    6: {
+        "loopback": ("::1/128",),
+        "unspecified": ("::/128",),
+        "reserved": (
+            "::/8", "100::/8", "200::/7", "400::/6", "800::/5", "1000::/4", "4000::/3", "6000::/3",
+            "8000::/3", "a000::/3", "c000::/3", "e000::/4", "f000::/5", "f800::/6", "fe00::/9",
+        ),
+        "multicast": ("ff00::/8",),
+        "site_local": ("fec0::/10",),
+        "link_local": ("fe80::/10",),
+        "shared": (),
+        "private": (
+            "::1/128", "::/128", "::ffff:0:0/96", "100::/64", "2001::/23", "2001:2::/48", "2001:db8::/32",
+            "2001:10::/28", "fc00::/7", "fe80::/10",
+        ),
+    },
+}
+
+# labels in the order of precedence, a range gets the first label whose flag holds for both ends
+_type_labels = (
+    ("loopback", "Loopback"),
+    ("unspecified", "Unspecified"),
+    ("reserved", "Reserved"),
+    ("multicast", "Multicast"),
+    ("site_local", "Site local"),
+    ("link_local", "Link local"),
+)
+
+
+def _build_type_table(ranges: dict) -> tuple[list, list, list]:
+    """
+    Splits the address space into segments where membership in the special ranges does not change
+    :param ranges: dictionary of kind and tuple of networks
+    :return: tuple (segment starts, flag bits of each segment, bits of private networks containing each segment)
+    """
+    bounds = {0}
+    for nets in ranges.values():
+        for net in map(ip_network, nets):
+            bounds.add(int(net.network_address))
+            bounds.add(int(net.broadcast_address) + 1)
+    starts = sorted(bounds)
+    flags = []
+    private = []
+    for segment in starts:
+        flag = 0
+        for bit, kind in enumerate(kind for kind in ranges if kind != "private"):
+            if any(segment in _int_range(net) for net in ranges[kind]):
+                flag |= 1 << bit
+        flags.append(flag)
+        private.append(sum(1 << bit for bit, net in enumerate(ranges["private"]) if segment in _int_range(net)))
+    return starts, flags, private
+
+
+def _int_range(net: str) -> range:
+    """
+    :param net: network string
+    :return: range of integer addresses of the network
+    """
+    net = ip_network(net)
+    return range(int(net.network_address), int(net.broadcast_address) + 1)
+
+
+_type_tables = {version: _build_type_table(ranges) for version, ranges in _special_ranges.items()}
+_type_bits = {
+    version: {kind: 1 << bit for bit, kind in enumerate(kind for kind in ranges if kind != "private")}
+    for version, ranges in _special_ranges.items()
+}
+
+
+def classify_ranges(version: int, ranges: Iterable[tuple[int, int]]) -> list[str]:
+    """
+    Specifies the types of many address ranges at once, one bisect per range end
+    :param version: IP version of the ranges
+    :param ranges: (first, last) integer address pairs, a network is (network address, broadcast address),
+    an address is (address, address)
+    :return: list of types in the same order, labels are the same as _fill_network_type returns
+    """
+    starts, flags, private = _type_tables[version]
+    bits = _type_bits[version]
+    checks = [(bits[kind], label) for kind, label in _type_labels if kind in bits]
+    shared = bits["shared"]
+    types = []
+    for first, last in ranges:
+        low = bisect_right(starts, first) - 1
+        high = low if first == last else bisect_right(starts, last) - 1
+        both = flags[low] & flags[high]
+        for bit, label in checks:
+            if both & bit:
+                types.append(label)
+                break
+        else:
+            if private[low] & private[high]:
+                types.append("Private")
+            elif not both & shared:
+                types.append("Global")
+            else:
+                types.append(" ")
+    return types
 
 
 def _fill_network_type(target_address: IPv4Network | IPv6Network | IPv4Address | IPv6Address) -> str:
@@ -74,24 +301,11 @@ def _fill_network_type(target_address: IPv4Network | IPv6Network | IPv4Address |
     :param target_address: IPv4Network, IPv6Network, IPv4Address, IPv6Address object
     :return: Type of address
     """
-    if target_address.is_loopback:
-        return "Loopback"
-    elif target_address.is_unspecified:
-        return "Unspecified"
-    elif target_address.is_reserved:
-        return "Reserved"
-    elif target_address.is_multicast:
-        return "Multicast"
-    elif target_address.version == 6 and target_address.is_site_local:
-        return "Site local"
-    elif target_address.is_link_local:
-        return "Link local"
-    elif target_address.is_private:
-        return "Private"
-    elif target_address.is_global:
-        return "Global"
+    if isinstance(target_address, (IPv4Network, IPv6Network)):
+        first, last = int(target_address.network_address), int(target_address.broadcast_address)
     else:
-        return " "
+        first = last = int(target_address)
+    return classify_ranges(target_address.version, ((first, last),))[0]
 
 
 def _fill_v4_class(packed_address: bytes) -> str:
@@ -100,108 +314,259 @@ def _fill_v4_class(packed_address: bytes) -> str:
     :param packed_address: bytes
     :return: Class of address
     """
-    bin_addr = _get_doted_binary(packed_address)
-    if bin_addr.startswith('0'):
+    return _fill_v4_class_int(packed_address[0])
+
+
+def _fill_v4_class_int(first_octet: int) -> str:
+    """
+    Specifies the class of the address by its first octet
+    :param first_octet: int
+    :return: Class of address
+    """
+    if first_octet < 0b10000000:
         return "Class A"
-    elif bin_addr.startswith('10'):
+    elif first_octet < 0b11000000:
         return "Class B"
-    elif bin_addr.startswith('110'):
+    elif first_octet < 0b11100000:
         return "Class C"
-    elif bin_addr.startswith('1110'):
+    elif first_octet < 0b11110000:
         return "Class D"
-    elif bin_addr.startswith('1111'):
+    else:
         return "Class E"
 
 
-def _get_net_info(netw: IPv4Network | IPv6Network, addr: str = None) -> dict[str, str]:
+def _select_fields(getters: dict, fields: tuple[str]) -> dict:
+    """
+    Computes only requested fields
+    :param getters: dictionary of field name and function that computes the field
+    :param fields: names of requested fields
+    :return: dictionary with computed fields
+    """
+    return {key: getter() for key, getter in getters.items() if key in fields}
+
+
+def _get_net_info(netw: IPv4Network | IPv6Network, addr: str = None,
+                  fields: tuple[str] | None = None, net_type: str | None = None,
+                  compressed: bool = False) -> dict[str, str]:
     """
     Create dictionary with address parameters to pass to the template
     :param netw: IPv4Network or IPv6Network object
     :param addr: string address
+    :param fields: names of fields to compute, None - all fields
+    :param net_type: type of the network if it is already known
+    :param compressed: IPv6 addresses in compressed notation
     :return: dictionary with address parameters
     """
     if netw.version == 4:
         # return dict for IPv4 prefixes
+        masks = _v4_masks[netw.prefixlen]
+        network = int(netw.network_address)
+        broadcast = network | (0xFFFFFFFF >> netw.prefixlen)
         if netw.prefixlen == 31 or netw.prefixlen == 32:
-            host_min = netw.network_address
-            host_max = netw.broadcast_address
+            host_min = network
+            host_max = broadcast
             hosts = 0
         else:
-            host_min = netw.network_address + 1
-            host_max = netw.broadcast_address - 1
-            hosts = netw.num_addresses - 2
-        return {
-            'version': f"IPv{netw.version}",
-            'address': addr if addr else "",
-            'address_db': _get_doted_binary(IPv4Address(addr).packed) if addr else "",
-            'address_type': _fill_network_type(IPv4Address(addr)) if addr else "",
-            'network_dd': netw.__str__(),
-            'network_db': _get_doted_binary(netw.network_address.packed),
-            'preflen': netw.prefixlen,
-            'netmask_dd': netw.netmask.__str__(),
-            'netmask_db': _get_doted_binary(netw.netmask.packed),
-            'wildcard_dd': netw.hostmask.__str__(),
-            'wildcard_db': _get_doted_binary(netw.hostmask.packed),
-            'hostmin_dd': host_min.__str__(),
-            'hostmin_db': _get_doted_binary(host_min.packed),
-            'hostmax_dd': host_max.__str__(),
-            'hostmax_db': _get_doted_binary(host_max.packed),
-            'broadcast_dd': netw.broadcast_address.__str__(),
-            'broadcast_db': _get_doted_binary(netw.broadcast_address.packed),
-            'hosts': hosts,
-            'type': _fill_network_type(netw),
-            'class': _fill_v4_class(netw.network_address.packed),
-        }
+            host_min = network + 1
+            host_max = broadcast - 1
+            hosts = broadcast - network - 1
+        if fields is None:
+            return {
+                'version': f"IPv{netw.version}",
+                'address': addr if addr else "",
+                'address_db': _get_doted_binary(IPv4Address(addr).packed) if addr else "",
+                'address_type': _fill_network_type(IPv4Address(addr)) if addr else "",
+                'network_dd': netw.__str__(),
+                'network_db': _int_doted_binary(network),
+                'preflen': netw.prefixlen,
+                'netmask_dd': masks[0],
+                'netmask_db': masks[1],
+                'wildcard_dd': masks[2],
+                'wildcard_db': masks[3],
+                'hostmin_dd': _int_doted_decimal(host_min),
+                'hostmin_db': _int_doted_binary(host_min),
+                'hostmax_dd': _int_doted_decimal(host_max),
+                'hostmax_db': _int_doted_binary(host_max),
+                'broadcast_dd': _int_doted_decimal(broadcast),
+                'broadcast_db': _int_doted_binary(broadcast),
+                'hosts': hosts,
+                'type': net_type or classify_ranges(4, ((network, broadcast),))[0],
+                'class': _fill_v4_class_int(network >> 24),
+            }
+        return _select_fields({
+            'version': lambda: f"IPv{netw.version}",
+            'address': lambda: addr if addr else "",
+            'address_db': lambda: _get_doted_binary(IPv4Address(addr).packed) if addr else "",
+            'address_type': lambda: _fill_network_type(IPv4Address(addr)) if addr else "",
+            'network_dd': lambda: netw.__str__(),
+            'network_db': lambda: _int_doted_binary(network),
+            'preflen': lambda: netw.prefixlen,
+            'netmask_dd': lambda: masks[0],
+            'netmask_db': lambda: masks[1],
+            'wildcard_dd': lambda: masks[2],
+            'wildcard_db': lambda: masks[3],
+            'hostmin_dd': lambda: _int_doted_decimal(host_min),
+            'hostmin_db': lambda: _int_doted_binary(host_min),
+            'hostmax_dd': lambda: _int_doted_decimal(host_max),
+            'hostmax_db': lambda: _int_doted_binary(host_max),
+            'broadcast_dd': lambda: _int_doted_decimal(broadcast),
+            'broadcast_db': lambda: _int_doted_binary(broadcast),
+            'hosts': lambda: hosts,
+            'type': lambda: net_type or classify_ranges(4, ((network, broadcast),))[0],
+            'class': lambda: _fill_v4_class_int(network >> 24),
+        }, fields)
     else:
-        # return dict for IPv6 prefixes
-        if netw.prefixlen == 127 or netw.prefixlen == 128:
-            host_min = str(netw.network_address.exploded)
-            host_max = str(netw.broadcast_address.exploded)
-            hosts = 0
-        else:
-            host_min = str((netw.network_address + 1).exploded)
-            host_max = str((netw.broadcast_address - 1).exploded)
-            hosts = netw.num_addresses - 2
+        return _get_v6_info(int(netw.network_address), netw.prefixlen, addr, fields, net_type, compressed)
+
+
+def _get_v6_info(network: int, prefixlen: int, addr: str = None, fields: tuple[str] | None = None,
+                 net_type: str | None = None, compressed: bool = False) -> dict[str, str]:
+    """
+    Create dictionary with IPv6 address parameters, every field is formatted from integers
+    :param network: integer network address
+    :param prefixlen: prefix length
+    :param addr: string address
+    :param fields: names of fields to compute, None - all fields
+    :param net_type: type of the network if it is already known
+    :param compressed: addresses in compressed notation
+    :return: dictionary with address parameters
+    """
+    formatter = _v6_compressed if compressed else _v6_exploded
+    masks = _v6_masks[compressed][prefixlen]
+    broadcast = network | ((1 << (128 - prefixlen)) - 1)
+    if prefixlen == 127 or prefixlen == 128:
+        host_min = network
+        host_max = broadcast
+        hosts = 0
+    else:
+        host_min = network + 1
+        host_max = broadcast - 1
+        hosts = broadcast - network - 1
+    if fields is None:
         return {
-            'version': f"IPv{netw.version}",
-            'address': IPv6Address(addr).exploded.__str__() if addr else "",
+            'version': "IPv6",
+            'address': formatter(int(IPv6Address(addr))) if addr else "",
             'address_type': _fill_network_type(IPv6Address(addr)) if addr else "",
-            'netmask_hex': netw.netmask.exploded.__str__(),
-            'preflen': netw.prefixlen,
-            'wildcard_hex': netw.hostmask.exploded.__str__(),
-            'network_hex': netw.exploded.__str__(),
-            'broadcast_hex': netw.broadcast_address.exploded.__str__(),
-            'hostmin_hex': host_min,
-            'hostmax_hex': host_max,
+            'netmask_hex': masks[0],
+            'preflen': prefixlen,
+            'wildcard_hex': masks[1],
+            'network_hex': f"{formatter(network)}/{prefixlen}",
+            'broadcast_hex': formatter(broadcast),
+            'hostmin_hex': formatter(host_min),
+            'hostmax_hex': formatter(host_max),
             'hosts': hosts,
-            'type': _fill_network_type(netw),
+            'type': net_type or classify_ranges(6, ((network, broadcast),))[0],
         }
+    return _select_fields({
+        'version': lambda: "IPv6",
+        'address': lambda: formatter(int(IPv6Address(addr))) if addr else "",
+        'address_type': lambda: _fill_network_type(IPv6Address(addr)) if addr else "",
+        'netmask_hex': lambda: masks[0],
+        'preflen': lambda: prefixlen,
+        'wildcard_hex': lambda: masks[1],
+        'network_hex': lambda: f"{formatter(network)}/{prefixlen}",
+        'broadcast_hex': lambda: formatter(broadcast),
+        'hostmin_hex': lambda: formatter(host_min),
+        'hostmax_hex': lambda: formatter(host_max),
+        'hosts': lambda: hosts,
+        'type': lambda: net_type or classify_ranges(6, ((network, broadcast),))[0],
+    }, fields)
+
+
+def _normalise_request(user_string: str) -> tuple:
+    """
+    Parses the user request into canonical address, network and subnet prefix
+    :param user_string: raw string from user request
+    :return: tuple (address, network, subnet prefix or None)
+    """
+    parsed_args = _parse_input(user_string)
+    if not parsed_args:
+        raise ValueError(f"{user_string!r} does not contain an address")
+    parsed_args_len = len(parsed_args)
+    addr = parsed_args[0]
+    network = ip_network(f"{addr}/{parsed_args[1]}", strict=False) if parsed_args_len > 1 else ip_network(f"{addr}")
+    sub_pfx = None
+    if parsed_args_len >= 3:
+        first_prefix = _normalise_subnet_prefix(parsed_args[1])
+        second_prefix = _check_second_prefix(parsed_args[2])
+        if second_prefix:
+            second_prefix = _normalise_subnet_prefix(second_prefix.group(0))
+            if first_prefix > second_prefix:
+                network = ip_network(f"{addr}/{second_prefix}", strict=False)
+                sub_pfx = first_prefix
+            else:
+                sub_pfx = second_prefix
+    return str(ip_address(addr)), network, sub_pfx
 
 
-def calc_dispatcher(user_string: str) -> dict[str, str]:
+def calc_key(user_string: str, offset: int = 0, limit: int = subnets_limit,
+             fields: tuple[str] | None = None, compressed: bool = False) -> tuple:
     """
-    Main function dispatcher, processes arguments and returns dictionaries
+    Canonical key of the request, requests with equal keys have equal calc_dispatcher results
     :param user_string: raw string from user request
+    :param offset: index of the first subnet on the page
+    :param limit: maximum number of subnets on the page
+    :param fields: names of fields to compute, None - all fields
+    :param compressed: IPv6 addresses in compressed notation
+    :return: tuple (address, network, subnet prefix, offset, limit, fields, compressed)
+    """
+    addr, network, sub_pfx = _normalise_request(user_string)
+    if fields is not None:
+        fields = tuple(sorted(set(fields)))
+    if sub_pfx is None:
+        offset, limit = 0, subnets_limit
+    return addr, network, sub_pfx, offset, limit, fields, bool(compressed) and network.version == 6
+
+
+def calc_result(key: tuple) -> dict[str, str]:
+    """
+    Computes the result of a request without the cache
+    :param key: result of calc_key
+    :return: Ready-made dictionary for substitution into a template
+    """
+    addr, network, sub_pfx, offset, limit, fields, compressed = key
+    sub_info = _find_subnets(network, sub_pfx, offset, limit, fields, compressed) if sub_pfx is not None else {}
+    net_info = _get_net_info(network, addr, fields, compressed=compressed)
+    return {**net_info, **sub_info}
+
+
+def calc_dispatcher(user_string: str, offset: int = 0, limit: int = subnets_limit,
+                    fields: tuple[str] | None = None, compressed: bool = False,
+                    compute=calc_result) -> dict[str, str]:
+    """
+    Main function dispatcher, processes arguments and returns dictionaries.
+    Results are cached by canonical network and subnet prefix, cached dictionaries are shared, do not modify them
+    :param user_string: raw string from user request
+    :param offset: index of the first subnet on the page
+    :param limit: maximum number of subnets on the page
+    :param fields: names of fields to compute for the network and subnets, None - all fields
+    :param compressed: IPv6 addresses in compressed notation
+    :param compute: function that computes the result of a calc_key on a cache miss
     :return: Ready-made dictionary for substitution into a template
     """
     try:
-        parsed_args = _parse_input(user_string)
-        parsed_args_len = len(parsed_args)
-        addr = parsed_args[0]
-        network = ip_network(f"{addr}/{parsed_args[1]}", strict=False) if parsed_args_len > 1 else ip_network(f"{addr}")
-        sub_info = {}
-        if parsed_args_len >= 3:
-            first_prefix = _normalise_subnet_prefix(parsed_args[1])
-            second_prefix = _check_second_prefix(parsed_args[2])
-            if second_prefix:
-                second_prefix = _normalise_subnet_prefix(second_prefix.group(0))
-                if first_prefix > second_prefix:
-                    network = ip_network(f"{addr}/{second_prefix}", strict=False)
-                    sub_pfx = first_prefix
-                else:
-                    sub_pfx = second_prefix
-                sub_info = _find_subnets(network, sub_pfx)
-        net_info = _get_net_info(network, addr)
-        return {**net_info, **sub_info}
+        with metrics.timer("parse"):
+            key = calc_key(user_string, offset, limit, fields, compressed)
+        result = calc_cache.get(key)
+        if result is None:
+            with metrics.timer("compute"):
+                result = compute(key)
+            calc_cache.set(key, result)
+        metrics.observe_size("subnets", len(result.get("subnets", ())))
+        return result
     except (ValueError, TypeError) as error:
         return {"net_error": str(error)}
+
+
+def calc_bulk(queries: list[str], workers: int = 0) -> Iterator[dict[str, str]]:
+    """
+    Processes many requests with calc_dispatcher and yields results in the order of queries
+    :param queries: list of raw strings from user request
+    :param workers: number of worker processes of the shared pool, large batches are fanned out when it is not 0
+    :return: iterator of dictionaries, errors are reported per item in net_error
+    """
+    queries = [str(query) for query in queries]
+    if workers > 0 and len(queries) >= bulk_pool_threshold:
+        yield from offload_map(workers, calc_dispatcher, queries, chunksize=max(len(queries) // (workers * 4), 1))
+    else:
+        yield from map(calc_dispatcher, queries)
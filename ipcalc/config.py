@@ -1,3 +1,16 @@
 class Configuration:
     DEBUG = False
     JSON_SORT_KEYS = False
+    CACHE_MAX_AGE = 86400  # Cache-Control max-age of calculator pages and API responses, seconds
+    CPU_WORKERS = 0  # worker processes for heavy calculations, 0 - calculate in the request worker
+    # sort/sum lists of at least sort_sum.parallel_min_lines lines are split over the CPU_WORKERS processes
+    HEAVY_LINES = 10000  # sort/sum inputs with more lines are calculated in the process pool
+    HEAVY_SUBNETS = 256  # subnet pages with more rows are calculated in the process pool
+    TRIE_MAX_NETWORKS = 1000000  # longest list for /api/trie, its trie is built in the request worker
+    AGGREGATE_MAX_NETWORKS = 1000000  # longest list for /api/aggregate, its trie is built in the request worker
+    HEAVY_PASSWORD_CHARS = 16384  # password batches with more characters are generated in the process pool
+    METRICS = False  # per-request stage timings in Server-Timing headers and Prometheus metrics at /metrics
+    HTML_SUBNETS_PAGE = 256  # subnets on the first HTML page, larger pages are streamed
+    TEMPLATE_BYTECODE_DIR = None  # directory of the compiled templates cache, None - system temporary directory
+    RESULT_STORE_DIR = None  # directory of the on-disk store of large sort/sum results, None - no store
+    RESULT_STORE_MAX_BYTES = 1 << 30  # total size of the stored results, least recently used are evicted
@@ -1,12 +1,89 @@
 import logging
 import string
 import secrets
+from itertools import islice
+from typing import Iterator
+
+import metrics
 
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 
+def _random_bytes(chunk: int = 4096) -> Iterator[int]:
+    """
+    Endless stream of random bytes drawn in bulk from the CSPRNG
+    :param chunk: number of bytes per secrets.token_bytes call
+    :return: iterator of integers 0-255
+    """
+    while True:
+        yield from secrets.token_bytes(chunk)
+
+
+def _random_below(limit: int, random_bytes: Iterator[int]) -> int:
+    """
+    Unbiased random integer in range(limit), bytes over the largest multiple of limit are rejected
+    :param limit: upper bound, 1-256
+    :param random_bytes: stream of random bytes
+    :return: int
+    """
+    bound = 256 - 256 % limit
+    for byte in random_bytes:
+        if byte < bound:
+            return byte % limit
+
+
+def _random_chars(alphabet: str, count: int, random_bytes: Iterator[int]) -> list[str]:
+    """
+    Chooses count characters from the alphabet uniformly
+    :param alphabet: characters to choose from, at most 256
+    :param count: number of characters
+    :param random_bytes: stream of random bytes
+    :return: list of characters
+    """
+    if not alphabet:
+        raise IndexError("Cannot choose from an empty sequence")
+    size = len(alphabet)
+    bound = 256 - 256 % size
+    chars = []
+    while len(chars) < count:
+        chars.extend(alphabet[byte % size] for byte in islice(random_bytes, count - len(chars)) if byte < bound)
+    return chars
+
+
+def _shuffle(chars: list, random_bytes: Iterator[int]) -> None:
+    """
+    Fisher-Yates shuffle in place with the CSPRNG
+    :param chars: list, at most 256 items
+    :param random_bytes: stream of random bytes
+    """
+    for i in range(len(chars) - 1, 0, -1):
+        j = _random_below(i + 1, random_bytes)
+        chars[i], chars[j] = chars[j], chars[i]
+
+
+def _make_password(alphabet: str, classes: list[str], letters: str, pass_len: int,
+                   random_bytes: Iterator[int]) -> str:
+    """
+    Builds a password that contains every required class by construction
+    :param alphabet: all allowed characters
+    :param classes: allowed characters of every required class
+    :param letters: allowed letters for the first character, empty if the first character is not restricted
+    :param pass_len: password length
+    :param random_bytes: stream of random bytes
+    :return: password
+    """
+    first = ""
+    if letters:
+        first = _random_chars(letters, 1, random_bytes)[0]
+        classes = [chars for chars in classes if first not in chars]
+    chars = [_random_chars(chars, 1, random_bytes)[0] for chars in classes]
+    chars += _random_chars(alphabet, pass_len - len(first) - len(chars), random_bytes)
+    _shuffle(chars, random_bytes)
+    return first + "".join(chars)
+
+
 def generate_passwords(**kwargs):
     """
 
@@ -19,16 +96,26 @@ def generate_passwords(**kwargs):
     logger.debug(f"keys = {keys}")
 
     alphabet = ''
+    classes = []
     if 'nums' in keys:
         alphabet += string.digits
+        classes.append(string.digits)
     if 'lchar' in keys:
         alphabet += string.ascii_lowercase
+        classes.append(string.ascii_lowercase)
     if 'uchar' in keys:
         alphabet += string.ascii_uppercase
+        classes.append(string.ascii_uppercase)
     if 'special' in keys:
         alphabet += string.punctuation
+        classes.append(string.punctuation)
     if 'exclude' in keys:
-        alphabet = ''.join(set(alphabet) - set(kwargs.get('exclude', '')))
+        exclude = set(kwargs.get('exclude', ''))
+        alphabet = ''.join(set(alphabet) - exclude)
+        classes = [''.join(set(chars) - exclude) for chars in classes]
+    letters = ''
+    if ('lstart' in keys) and ('lchar' in keys or 'uchar' in keys):
+        letters = ''.join(char for char in alphabet if char.isalpha())
     try:
         pass_len = int(kwargs.get('length')) if kwargs.get('length') else 16
         pass_quant = int(kwargs.get('quantity')) if kwargs.get('quantity') else 8
@@ -40,25 +127,13 @@ def generate_passwords(**kwargs):
             return {"pass_error": "The number of passwords cannot be less than one"}
         if pass_quant > 512:
             return {"pass_error": "The number of passwords cannot be more than 512"}
-        for i in range(pass_quant):
-            while True:
-                password = ''.join(secrets.choice(alphabet) for i in range(pass_len))
-                if ('lstart' in keys) and ('lchar' in keys or 'uchar' in keys) and not password[0].isalpha():
-                    continue
-                elif 'nums' in keys and not any(c.isdigit() for c in password):
-                    continue
-                elif 'lchar' in keys and not any(c.islower() for c in password):
-                    continue
-                elif 'uchar' in keys and not any(c.isupper() for c in password):
-                    continue
-                elif 'special' in keys and not any(c in string.punctuation for c in password):
-                    continue
-                else:
-                    break
-            passwords.append(password)
+        if alphabet and not all(classes):
+            return {"pass_error": "All characters of a selected character set are excluded"}
+        random_bytes = _random_bytes()
+        with metrics.timer("compute"):
+            for i in range(pass_quant):
+                passwords.append(_make_password(alphabet, classes, letters, pass_len, random_bytes))
+        metrics.observe_size("passwords", pass_quant)
         return {"passwords": passwords}
     except IndexError as error:
         return {"pass_error": error}
-
-
-
@@ -1,5 +1,6 @@
 from pathlib import Path
 from flask import Flask
+from jinja2 import ChoiceLoader, FileSystemBytecodeCache, ModuleLoader
 from config import Configuration
 
 
@@ -12,6 +13,10 @@ def get_app():
     app = Flask(__name__)
     app.config.from_object(Configuration)
     setattr(app, "version", version)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["TEMPLATE_BYTECODE_DIR"])
+    compiled_templates = ROOT_DIR / "compiled_templates"  # built by deployment.py
+    if compiled_templates.is_dir():
+        app.jinja_env.loader = ChoiceLoader([ModuleLoader(compiled_templates), app.jinja_env.loader])
     return app
 
 
@@ -1,4 +1,14 @@
+import argparse
+
 from view import application
 
 if __name__ == "__main__":
-    application.run(host="0.0.0.0")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--asgi", action="store_true", help="serve with uvicorn instead of the development server")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    if args.asgi:
+        import uvicorn
+        uvicorn.run("asgi:asgi_app", host="0.0.0.0", port=args.port)
+    else:
+        application.run(host="0.0.0.0", port=args.port)
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+enabled = False  # set from Configuration.METRICS, timers are no-ops while disabled
+
+_time_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_size_buckets = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+_request_timings = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with one label
+    """
+
+    def __init__(self, name: str, description: str, label: str, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # counts per bucket plus +Inf, then sum
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        """
+        :return: lines in the Prometheus text exposition format
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, total) in sorted(self._series.items()):
+                labels = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total}")
+                lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram("ipcalc_stage_seconds", "Time spent in request stages", "stage", _time_buckets)
+input_size = Histogram("ipcalc_input_size", "Request input sizes", "kind", _size_buckets)
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stage_seconds.observe(self.stage, elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((self.stage, elapsed))
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timer(stage: str) -> _Timer | _NullTimer:
+    """
+    Context manager that times a stage: parse, compute, render or serialize
+    :param stage: name of the stage
+    :return: context manager
+    """
+    return _Timer(stage) if enabled else _null_timer
+
+
+def observe_size(kind: str, value: int) -> None:
+    """
+    Records an input size
+    :param kind: lines, subnets, passwords, queries
+    :param value: size
+    """
+    if enabled:
+        input_size.observe(kind, value)
+
+
+def start_request() -> None:
+    """
+    Starts collecting stage timings of the current request
+    """
+    _request_timings.set([])
+
+
+def server_timing() -> str:
+    """
+    :return: Server-Timing header value with the stages of the current request in milliseconds
+    """
+    totals = {}
+    for stage, elapsed in _request_timings.get() or ():
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.3f}" for stage, elapsed in totals.items())
+
+
+def render() -> str:
+    """
+    :return: all metrics in the Prometheus text exposition format
+    """
+    return "\n".join(stage_seconds.render() + input_size.render()) + "\n"
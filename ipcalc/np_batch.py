@@ -0,0 +1,85 @@
+import logging
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+min_size = 20000  # batches smaller than this are faster in pure Python
+
+
+np = None  # numpy is imported on the first large batch, it is slow to import and most requests never need it
+_np_checked = False
+
+
+def use_numpy(size: int) -> bool:
+    """
+    :param size: number of items in the batch
+    :return: True if numpy is installed and the batch is large enough
+    """
+    global np, _np_checked
+    if size < min_size:
+        return False
+    if not _np_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            logger.debug("numpy is not installed, using pure Python")
+        _np_checked = True
+    return np is not None
+
+
+def _v4_arrays(nets: list[tuple]) -> tuple:
+    """
+    Converts IPv4 networks to arrays, removes duplicates and sorts them by start, then prefixlen
+    :param nets: list of (version, start, prefixlen) tuples, IPv6 networks are skipped
+    :return: tuple of int64 arrays (starts, prefixlens)
+    """
+    keys = np.fromiter((start << 6 | prefixlen for version, start, prefixlen in nets if version == 4), dtype=np.int64)
+    keys = np.unique(keys)
+    return keys >> 6, keys & 63
+
+
+def _to_nets(starts, lens) -> list[tuple]:
+    return list(zip([4] * len(starts), starts.tolist(), lens.tolist()))
+
+
+def sort_unique_v4(nets: list[tuple]) -> list[tuple]:
+    """
+    Removes duplicates and sorts IPv4 networks
+    :param nets: list of (version, start, prefixlen) tuples, IPv6 networks are skipped
+    :return: sorted list of unique (4, start, prefixlen) tuples
+    """
+    return _to_nets(*_v4_arrays(nets))
+
+
+def collapse_v4(nets: list[tuple]) -> list[tuple]:
+    """
+    Collapses adjacent and contained IPv4 networks with vectorized passes
+    :param nets: list of (version, start, prefixlen) tuples in any order, IPv6 networks are skipped
+    :return: minimal sorted list of (4, start, prefixlen) tuples covering the same addresses
+    """
+    starts, lens = _v4_arrays(nets)
+    if not len(starts):
+        return []
+
+    # drop networks contained in any network before them
+    ends = starts + np.left_shift(1, 32 - lens) - 1
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = starts[1:] > np.maximum.accumulate(ends)[:-1]
+    starts, lens = starts[keep], lens[keep]
+
+    # merge sibling pairs level by level, the loop runs at most 33 times
+    while len(starts) > 1:
+        sizes = np.left_shift(1, 32 - lens)
+        left = ((lens[:-1] == lens[1:]) & (lens[:-1] > 0)
+                & (starts[:-1] & sizes[:-1] == 0) & (starts[:-1] + sizes[:-1] == starts[1:]))
+        if not left.any():
+            break
+        merged = np.zeros(len(starts), dtype=bool)
+        merged[:-1] = left
+        right = np.zeros(len(starts), dtype=bool)
+        right[1:] = left
+        lens = np.where(merged, lens - 1, lens)[~right]
+        starts = starts[~right]
+    return _to_nets(starts, lens)
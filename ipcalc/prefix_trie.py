@@ -0,0 +1,234 @@
+import gc
+import logging
+from typing import Iterable, Iterator
+
+from sort_sum import range_to_cidrs
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+_max_lens = {
+    4: 32,
+    6: 128,
+}
+
+
+class _Node:
+    """
+    Node of the compressed trie, a node exists only where a network is stored or where two branches meet
+    """
+    __slots__ = ("start", "prefixlen", "is_net", "children")
+
+    def __init__(self, start: int, prefixlen: int, is_net: bool):
+        self.start = start
+        self.prefixlen = prefixlen
+        self.is_net = is_net
+        self.children = [None, None]
+
+
+def _bit(address: int, position: int, max_len: int) -> int:
+    """
+    :return: bit of the address at position, counting from the most significant bit
+    """
+    return (address >> (max_len - 1 - position)) & 1
+
+
+def _covers(node: _Node, start: int, prefixlen: int, max_len: int) -> bool:
+    """
+    :return: True if the node prefix contains the network start/prefixlen
+    """
+    return node.prefixlen <= prefixlen and not (node.start ^ start) >> (max_len - node.prefixlen)
+
+
+class PrefixTrie:
+    """
+    Compressed radix (Patricia) trie of IPv4 and IPv6 networks.
+    Networks are (version, start, prefixlen) tuples as returned by sort_sum.get_sorted_nets,
+    every lookup walks at most one path from the root, so it takes O(prefix length)
+    """
+
+    def __init__(self, nets: Iterable[tuple] = ()):
+        """
+        :param nets: initial (version, start, prefixlen) tuples, they are loaded in one pass
+        """
+        self._roots = {version: None for version in _max_lens}
+        self.size = 0
+        nets = sorted(set(nets))
+        # the cyclic garbage collector would rescan the growing trie many times while it is built
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for version in _max_lens:
+                self._build(version, [(start, prefixlen) for net_version, start, prefixlen in nets
+                                      if net_version == version])
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _build(self, version: int, pairs: list[tuple[int, int]]) -> None:
+        """
+        Builds the trie of one address family from sorted unique networks, keeping a stack of the rightmost path
+        :param pairs: list of (start, prefixlen) pairs sorted by start, then prefixlen
+        """
+        max_len = _max_lens[version]
+        stack = []
+        for start, prefixlen in pairs:
+            child = None
+            while stack and (stack[-1].prefixlen > prefixlen
+                             or (stack[-1].start ^ start) >> (max_len - stack[-1].prefixlen)):
+                child = stack.pop()
+            parent = stack[-1] if stack else None
+            if child is not None:
+                # the previous network and this one meet below parent, insert a node at the branching point
+                common = max_len - (child.start ^ start).bit_length()
+                if parent is None or common > parent.prefixlen:
+                    branch = _Node(start >> (max_len - common) << (max_len - common) if common else 0, common, False)
+                    if parent is None:
+                        self._roots[version] = branch
+                    else:
+                        parent.children[_bit(child.start, parent.prefixlen, max_len)] = branch
+                    branch.children[_bit(child.start, common, max_len)] = child
+                    stack.append(branch)
+                    parent = branch
+            node = _Node(start, prefixlen, True)
+            if parent is None:
+                self._roots[version] = node
+            else:
+                parent.children[_bit(start, parent.prefixlen, max_len)] = node
+            stack.append(node)
+        self.size += len(pairs)
+
+    def add(self, net: tuple) -> None:
+        """
+        Inserts a network
+        :param net: (version, start, prefixlen) tuple
+        """
+        version, start, prefixlen = net
+        max_len = _max_lens[version]
+        node = self._roots[version]
+        parent = None
+        while True:
+            if node is None:
+                node = _Node(start, prefixlen, True)
+                break
+            common = min(max_len - (node.start ^ start).bit_length(), node.prefixlen, prefixlen)
+            if common < node.prefixlen:
+                # the new network branches off inside the node prefix, insert a node at the branching point
+                branch = _Node(start >> (max_len - common) << (max_len - common) if common else 0, common, False)
+                branch.children[_bit(node.start, common, max_len)] = node
+                if common == prefixlen:
+                    branch.is_net = True
+                else:
+                    branch.children[_bit(start, common, max_len)] = _Node(start, prefixlen, True)
+                node = branch
+                break
+            if node.prefixlen == prefixlen:
+                if node.is_net:
+                    return
+                node.is_net = True
+                self.size += 1
+                return
+            parent, child_bit = node, _bit(start, node.prefixlen, max_len)
+            node = node.children[child_bit]
+            if node is None:
+                parent.children[child_bit] = _Node(start, prefixlen, True)
+                self.size += 1
+                return
+        self.size += 1
+        if parent is None:
+            self._roots[version] = node
+        else:
+            parent.children[child_bit] = node
+
+    def _path(self, version: int, start: int, prefixlen: int) -> Iterator[_Node]:
+        """
+        Walks from the root towards the network and yields nodes whose prefix contains it
+        """
+        max_len = _max_lens[version]
+        node = self._roots[version]
+        while node is not None and _covers(node, start, prefixlen, max_len):
+            yield node
+            if node.prefixlen == prefixlen:
+                return
+            node = node.children[_bit(start, node.prefixlen, max_len)]
+
+    def _first_inside(self, version: int, start: int, prefixlen: int) -> _Node | None:
+        """
+        :return: topmost node whose prefix is inside the network or equal to it
+        """
+        max_len = _max_lens[version]
+        node = self._roots[version]
+        while node is not None:
+            if node.prefixlen >= prefixlen:
+                return node if not (node.start ^ start) >> (max_len - prefixlen) else None
+            if not _covers(node, start, prefixlen, max_len):
+                return None
+            node = node.children[_bit(start, node.prefixlen, max_len)]
+        return None
+
+    @staticmethod
+    def _subtree(node: _Node | None, version: int, top_only: bool = False) -> Iterator[tuple]:
+        """
+        Yields networks of the subtree in address order
+        :param top_only: skip networks contained in other networks of the subtree
+        """
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            if node.is_net:
+                yield version, node.start, node.prefixlen
+                if top_only:
+                    continue
+            stack.extend(child for child in reversed(node.children) if child is not None)
+
+    def longest_match(self, net: tuple) -> tuple | None:
+        """
+        Longest-prefix match
+        :param net: (version, start, prefixlen) tuple, an address is a /32 or /128 network
+        :return: the most specific network that contains net or None
+        """
+        version, start, prefixlen = net
+        match = None
+        for node in self._path(version, start, prefixlen):
+            if node.is_net:
+                match = (version, node.start, node.prefixlen)
+        return match
+
+    def containing(self, net: tuple) -> list[tuple]:
+        """
+        :param net: (version, start, prefixlen) tuple
+        :return: networks that contain net, from the least to the most specific
+        """
+        version, start, prefixlen = net
+        return [(version, node.start, node.prefixlen) for node in self._path(version, start, prefixlen) if node.is_net]
+
+    def overlapping(self, net: tuple) -> list[tuple]:
+        """
+        :param net: (version, start, prefixlen) tuple
+        :return: networks that contain net or are contained in it, in address order
+        """
+        version, start, prefixlen = net
+        result = [found for found in self.containing(net) if found[2] < prefixlen]
+        result.extend(self._subtree(self._first_inside(version, start, prefixlen), version))
+        return result
+
+    def gaps(self, net: tuple) -> list[tuple]:
+        """
+        Free space inside net that is not covered by any network of the trie
+        :param net: (version, start, prefixlen) tuple
+        :return: minimal list of networks covering the free space, in address order
+        """
+        version, start, prefixlen = net
+        max_len = _max_lens[version]
+        if any(node.is_net for node in self._path(version, start, prefixlen)):
+            return []
+        free = []
+        first = start
+        for _, used_start, used_len in self._subtree(self._first_inside(version, start, prefixlen), version, True):
+            free.extend((version, *pair) for pair in range_to_cidrs(first, used_start - 1, max_len))
+            first = used_start + (1 << (max_len - used_len))
+        last = start + (1 << (max_len - prefixlen)) - 1
+        free.extend((version, *pair) for pair in range_to_cidrs(first, last, max_len))
+        return free
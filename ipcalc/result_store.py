@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Iterable
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+# file layout: header, IPv4 records, IPv6 records, errors as a JSON list of strings
+# IPv4 record - 8 bytes start << 8 | prefixlen, IPv6 record - 16 bytes start and 1 byte prefixlen
+_header = struct.Struct("<4sQQQ")
+_magic = b"IPS1"
+_v6_record = 17
+_swap = sys.byteorder != "little"  # records are little-endian
+format_version = 1  # part of every key, increase it when parsing or the file layout changes the stored results
+
+
+class ResultStore:
+    """
+    Content-addressed on-disk store of sort/sum results with size-capped LRU eviction.
+    Results are kept as fixed-width binary records and read through mmap, the file modification time
+    is the last use time. The store keeps no open files or locks, so it can be passed to worker processes
+    """
+
+    min_size = 65536  # inputs with fewer characters are cheaper to parse than to store
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        """
+        :param directory: directory of the result files, created on first use
+        :param max_bytes: maximum total size of the result files
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(action: str, raw: str | Iterable[str]) -> str:
+        """
+        :param action: name of the operation, results of different operations are stored separately
+        :param raw: networks, one per line, as a string or an iterable of lines,
+        line endings are normalized before hashing, so both forms of the same input have the same key
+        :return: hex digest of the result format version, the operation and the input
+        """
+        digest = hashlib.blake2b(f"{format_version}\0{action}".encode(), digest_size=20)
+        digest.update(b"\0")
+        if isinstance(raw, str):
+            digest.update("\n".join(raw.splitlines()).encode("utf-8", errors="surrogatepass"))
+            return digest.hexdigest()
+        separator = b""
+        for line in raw:
+            digest.update(separator)
+            digest.update(line.rstrip("\r\n").encode("utf-8", errors="surrogatepass"))
+            separator = b"\n"
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key: str) -> tuple | None:
+        """
+        Reads a stored result and marks it as recently used
+        :param key: result of ResultStore.key
+        :return: list of (version, start, prefixlen) tuples and list of errors or None if the result is not stored
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, v4_count, v6_count, errors_size = _header.unpack_from(data)
+                if magic != _magic:
+                    raise ValueError(f"{path} is not a result file")
+                offset = _header.size
+                v4_keys = array("Q")
+                v4_keys.frombytes(data[offset:offset + v4_count * 8])
+                if _swap:
+                    v4_keys.byteswap()
+                offset += v4_count * 8
+                nets = [(4, key >> 8, key & 255) for key in v4_keys]
+                nets.extend(
+                    (6, int.from_bytes(data[record:record + 16], "big"), data[record + 16])
+                    for record in range(offset, offset + v6_count * _v6_record, _v6_record)
+                )
+                offset += v6_count * _v6_record
+                errors = [ValueError(error) for error in json.loads(data[offset:offset + errors_size])]
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, struct.error) as error:
+            logger.warning(f"dropping unreadable result file: {error}")
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return nets, errors
+
+    def set(self, key: str, nets: list[tuple], errors: list) -> None:
+        """
+        Writes a result atomically and evicts the least recently used results above max_bytes
+        :param key: result of ResultStore.key
+        :param nets: sorted list of (version, start, prefixlen) tuples
+        :param errors: list of errors
+        """
+        v4_keys = array("Q", (start << 8 | prefixlen for version, start, prefixlen in nets if version == 4))
+        if _swap:
+            v4_keys.byteswap()
+        v6_records = b"".join(
+            start.to_bytes(16, "big") + bytes((prefixlen,)) for version, start, prefixlen in nets if version == 6
+        )
+        errors_data = json.dumps([str(error) for error in errors]).encode()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as file:
+                file.write(_header.pack(_magic, len(v4_keys), len(v6_records) // _v6_record, len(errors_data)))
+                file.write(v4_keys.tobytes())
+                file.write(v6_records)
+                file.write(errors_data)
+            os.replace(file.name, self._path(key))
+        except OSError as error:
+            logger.warning(f"result is not stored: {error}")
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used result files until their total size fits max_bytes
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".bin"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            self.evictions += 1
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".bin"):
+                    self._remove(os.path.join(self.directory, name))
+
+    def stats(self) -> dict[str, int]:
+        """
+        :return: dictionary with store counters of this process
+        """
+        return {
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
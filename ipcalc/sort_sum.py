@@ -1,64 +1,658 @@
-from ipaddress import ip_network
+import re
+import tempfile
+from array import array
+from heapq import merge
+from itertools import chain, islice
+from socket import inet_pton, AF_INET6
+from typing import Iterable, Iterator
+from ipaddress import ip_address, ip_network, IPv6Address
 from calculator import _parse_input
+import metrics
+import np_batch
+from workers import offload_map
 
 
-def get_sorted_nets(raw_input_from_web: str) -> tuple:
+parallel_min_lines = 200000  # string inputs with fewer lines are parsed in the calling process
+parallel_workers = 1  # default processes of the shared pool for large inputs, less than 2 - always serial
+stream_chunk_lines = 65536  # lines of an iterable input parsed at a time, at least as many as the result so far
+stream_max_errors = 1000  # errors kept for an iterable input, the others are only counted
+
+
+# Networks in the sort/sum pipeline are plain (version, start, prefixlen) integer tuples,
+# they are deduplicated and sorted natively and turned into strings only in get_out_form.
+_families = {
+    4: 32,
+    6: 128,
+}
+
+_netmasks = {
+    version: [
+        (((1 << max_len) - 1) ^ ((1 << (max_len - prefixlen)) - 1), (1 << (max_len - prefixlen)) - 1)
+        for prefixlen in range(max_len + 1)
+    ]
+    for version, max_len in _families.items()
+}
+
+
+def _address_str(version: int, value: int) -> str:
+    """
+    Converts an integer address to its string representation
+    :param version: 4 or 6
+    :param value: integer address
+    :return: str, example "192.168.0.0" or "2001:db8::"
+    """
+    if version == 4:
+        return f"{value >> 24}.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}"
+    return str(IPv6Address(value))
+
+
+_netmask_strs = {
+    version: [(_address_str(version, mask), _address_str(version, wildcard)) for mask, wildcard in masks]
+    for version, masks in _netmasks.items()
+}
+
+
+# IPv4 line with an optional prefix length or dotted mask, IPv6 line with an optional prefix length,
+# anything else is parsed by _parse_input and ip_network, only ASCII digits are matched
+_v4_line_re = re.compile(
+    r"\s*(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?:[\s/%\\_]+(?:(\d{1,2})|(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})))?\s*",
+    re.ASCII,
+)
+_v6_line_re = re.compile(r"\s*([0-9a-fA-F]*:[0-9a-fA-F:.]*)(?:[\s/%\\_]+(\d{1,3}))?\s*", re.ASCII)
+
+# range line "first - last", both ends are IPv4 or both are IPv6
+_range_line_re = re.compile(r"\s*([0-9a-fA-F.:]+)\s*-\s*([0-9a-fA-F.:]+)\s*")
+
+_octet_values = {str(octet): octet for octet in range(256)}  # no leading zeros, like ipaddress
+_v4_mask_lens = {mask: prefixlen for prefixlen, (mask, _) in enumerate(_netmasks[4])}
+_v4_wildcard_lens = {wildcard: prefixlen for prefixlen, (_, wildcard) in enumerate(_netmasks[4])}
+
+
+def _v4_int(address: str) -> int | None:
+    """
+    :param address: dotted decimal string with four groups of digits
+    :return: integer address or None if an octet is out of range or has a leading zero
+    """
+    a, b, c, d = address.split(".")
+    try:
+        return _octet_values[a] << 24 | _octet_values[b] << 16 | _octet_values[c] << 8 | _octet_values[d]
+    except KeyError:
+        return None
+
+
+def _parse_line(line: str) -> tuple | None:
+    """
+    Parses a line straight to integers without creating ip_network objects
+    :param line: network from the user
+    :return: (version, start, prefixlen) tuple or None if the line needs the full parser
+    """
+    match = _v4_line_re.fullmatch(line)
+    if match:
+        address, prefix, mask = match.groups()
+        address = _v4_int(address)
+        if address is None:
+            return None
+        if prefix is not None:
+            prefixlen = int(prefix)
+            if prefixlen > 32:
+                return None
+        elif mask is not None:
+            mask = _v4_int(mask)
+            prefixlen = _v4_mask_lens.get(mask, _v4_wildcard_lens.get(mask))
+            if prefixlen is None:
+                return None
+        else:
+            prefixlen = 32
+        return 4, address & _netmasks[4][prefixlen][0], prefixlen
+    match = _v6_line_re.fullmatch(line)
+    if match:
+        address, prefix = match.groups()
+        prefixlen = int(prefix) if prefix is not None else 128
+        if prefixlen > 128:
+            return None
+        try:
+            return 6, int.from_bytes(inet_pton(AF_INET6, address), "big") & _netmasks[6][prefixlen][0], prefixlen
+        except OSError:
+            return None
+    return None
+
+
+def _parse_range(line: str) -> tuple | None:
+    """
+    Parses an address range line
+    :param line: range from the user, example "10.0.0.1 - 10.0.0.14"
+    :return: (version, first, last) tuple or None if the line is not a range
+    """
+    match = _range_line_re.fullmatch(line)
+    if not match:
+        return None
+    first_str, last_str = match.groups()
+    first = last = None
+    if first_str.count(".") == 3 and last_str.count(".") == 3 and ":" not in first_str + last_str:
+        first, last = _v4_int(first_str), _v4_int(last_str)
+        version = 4
+    elif ":" in first_str and ":" in last_str:
+        try:
+            first = int.from_bytes(inet_pton(AF_INET6, first_str), "big")
+            last = int.from_bytes(inet_pton(AF_INET6, last_str), "big")
+            version = 6
+        except OSError:
+            first = None
+    if first is None or last is None:
+        first, last = ip_address(first_str), ip_address(last_str)
+        if first.version != last.version:
+            raise ValueError(f"{first_str} and {last_str} are of different versions")
+        version, first, last = first.version, int(first), int(last)
+    if first > last:
+        raise ValueError(f"first address {first_str} is greater than last address {last_str}")
+    return version, first, last
+
+
+def _parse_nets(raw_input_from_web: str | Iterable[str], ranges: list | None = None, first_line: int = 1) -> tuple:
+    """
+    Parses user networks, plain IPv4 and IPv6 lines go straight to integers,
+    "first - last" ranges are decomposed into the minimal list of networks,
+    other lines are parsed by _parse_input and ip_network
+    :param raw_input_from_web: networks, one per line, as a string or an iterable of lines
+    :param ranges: list for (version, first, last) tuples of range lines, None - decompose ranges into networks
+    :param first_line: number of the first line in error messages
+    :return: list of (version, start, prefixlen) tuples in input order and list of errors with line numbers
+    """
+    if isinstance(raw_input_from_web, str):
+        raw_input_from_web = raw_input_from_web.splitlines()
     user_nets = []
     errors = []
-    raw_addrs = (_parse_input(line.strip()) for line in raw_input_from_web.splitlines() if line)
-    for raw_addr in raw_addrs:
+    for line_number, line in enumerate(raw_input_from_web, first_line):
+        net = _parse_line(line)
+        if net is not None:
+            user_nets.append(net)
+            continue
+        if not line.strip():
+            continue
         try:
+            address_range = _parse_range(line)
+        except ValueError as error:
+            errors.append(ValueError(f"line {line_number}: {error}"))
+            continue
+        if address_range is not None:
+            if ranges is not None:
+                ranges.append(address_range)
+                continue
+            version, first, last = address_range
+            user_nets.extend((version, *pair) for pair in range_to_cidrs(first, last, _families[version]))
+            continue
+        raw_addr = _parse_input(line)
+        try:
+            if not raw_addr:
+                raise ValueError(f"{line!r} does not contain an address")
             if len(raw_addr) >= 2:
-                user_nets.append(ip_network(f"{raw_addr[0]}/{raw_addr[1]}", strict=False))
+                net = ip_network(f"{raw_addr[0]}/{raw_addr[1]}", strict=False)
             else:
-                user_nets.append(ip_network(f"{raw_addr[0]}", strict=False))
+                net = ip_network(f"{raw_addr[0]}", strict=False)
+            user_nets.append((net.version, int(net.network_address), net.prefixlen))
         except ValueError as error:
-            errors.append(error)
+            errors.append(ValueError(f"line {line_number}: {error}"))
+    return user_nets, errors
 
-    user_nets = set(user_nets)  # remove duplicates
-    user_nets = list(user_nets)
-    user_nets.sort()
 
-    return user_nets, errors
+def _fold_lines(lines: Iterable[str], fold, result, keep_ranges: bool) -> tuple:
+    """
+    Parses an iterable input chunk by chunk and folds every chunk into the result,
+    so memory follows the size of the result, not the size of the input
+    :param lines: networks, one per line
+    :param fold: function (result, list of networks, list of ranges or None) that returns the new result
+    :param result: initial result, a sized collection
+    :param keep_ranges: pass range lines to fold as (version, first, last) tuples instead of networks
+    :return: result and list of errors, errors above stream_max_errors are reported by the last one
+    """
+    lines = iter(lines)
+    errors = []
+    error_count = 0
+    line_count = 0
+    while chunk := list(islice(lines, max(stream_chunk_lines, len(result)))):
+        ranges = [] if keep_ranges else None
+        user_nets, chunk_errors = _parse_nets(chunk, ranges, line_count + 1)
+        line_count += len(chunk)
+        error_count += len(chunk_errors)
+        errors.extend(chunk_errors[:stream_max_errors - len(errors)])
+        result = fold(result, user_nets, ranges)
+    if error_count > len(errors):
+        errors.append(ValueError(f"{error_count - len(errors)} more errors are not shown"))
+    metrics.observe_size("lines", line_count)
+    return result, errors
 
 
-def get_out_form(nets: list, form) -> list:
+def _fold_unique(seen: set, user_nets: list, ranges: None) -> set:
+    seen.update(user_nets)
+    return seen
+
+
+def _fold_sum(summed_nets: list, user_nets: list, ranges: list) -> list:
+    return _sum(summed_nets + user_nets, ranges)
+
+
+def _shards(raw: str, count: int) -> list[tuple[str, int]]:
+    """
+    Splits the text into about count pieces on line boundaries
+    :param raw: networks, one per line
+    :param count: number of pieces
+    :return: list of (text, number of the first line of the text) tuples
+    """
+    shards = []
+    step = len(raw) // count + 1
+    begin = 0
+    first_line = 1
+    while begin < len(raw):
+        end = raw.find("\n", begin + step)
+        end = len(raw) if end == -1 else end + 1
+        piece = raw[begin:end]
+        shards.append((piece, first_line))
+        first_line += len(piece.splitlines())
+        begin = end
+    return shards
+
+
+def _pack(nets: Iterable[tuple]) -> tuple:
+    """
+    Packs sorted networks into compact picklable sorted keys start << 8 | prefixlen, one sequence per address family
+    :param nets: sorted iterable of (version, start, prefixlen) tuples
+    :return: tuple (array of IPv4 keys, list of IPv6 keys)
+    """
+    v4_keys = array("Q")
+    v6_keys = []
+    for version, start, prefixlen in nets:
+        (v4_keys if version == 4 else v6_keys).append(start << 8 | prefixlen)
+    return v4_keys, v6_keys
+
+
+def _sorted_shard(shard: tuple[str, int]) -> tuple:
+    """
+    Parses, deduplicates and sorts one piece of the input in a worker process
+    :param shard: tuple (piece of the input, number of its first line)
+    :return: tuple (packed networks, list of errors)
+    """
+    raw, first_line = shard
+    user_nets, errors = _parse_nets(raw, first_line=first_line)
+    return _pack(sorted(set(user_nets))), errors
+
+
+def _summed_shard(shard: tuple[str, int]) -> tuple:
+    """
+    Parses and collapses one piece of the input in a worker process
+    :param shard: tuple (piece of the input, number of its first line)
+    :return: tuple (packed networks, list of errors)
+    """
+    raw, first_line = shard
+    ranges = []
+    user_nets, errors = _parse_nets(raw, ranges, first_line)
+    return _pack(_sum(user_nets, ranges)), errors
+
+
+def _parallel(raw: str, shard_func, collapse: bool, workers: int | None) -> tuple | None:
+    """
+    Processes a large input in the shared process pool of workers.offload_map,
+    the pieces are parsed and pre-aggregated by the workers, their sorted keys are merged
+    and deduplicated or collapsed, the result is the same as in the calling process
+    :param raw: networks, one per line
+    :param shard_func: _sorted_shard or _summed_shard
+    :param collapse: collapse the merged networks
+    :param workers: number of worker processes, None - parallel_workers
+    :return: list of (version, start, prefixlen) tuples and list of errors, None if the input is too small
+    """
+    workers = parallel_workers if workers is None else workers
+    if workers < 2 or not isinstance(raw, str) or raw.count("\n") < parallel_min_lines:
+        return None
+    shards = _shards(raw, workers * 4)
+    with metrics.timer("parse"):
+        results = list(offload_map(workers, shard_func, shards))
+    metrics.observe_size("lines", shards[-1][1] + len(shards[-1][0].splitlines()) - 1)
+    errors = [error for _, shard_errors in results for error in shard_errors]
+
+    with metrics.timer("compute"):
+        nets = []
+        for index, (version, max_len) in enumerate(_families.items()):
+            # the pieces are sorted runs, sorted() merges them like a k-way merge
+            keys = sorted(chain.from_iterable(packed[index] for packed, _ in results))
+            if collapse:
+                pairs = [(key >> 8, key & 255) for key in keys]
+                nets.extend((version, start, prefixlen) for start, prefixlen in _collapse(pairs, max_len))
+            else:
+                nets.extend([(version, key >> 8, key & 255) for key in dict.fromkeys(keys)])
+    return nets, errors
+
+
+def _through_store(store, action: str, raw_input_from_web: str | Iterable[str], func, *args) -> tuple:
+    """
+    Serves a large input from the on-disk result store or computes the result and stores it
+    :param store: result_store.ResultStore or None
+    :param action: name of the operation
+    :param raw_input_from_web: networks, one per line, as a string or an iterable of lines
+    :param func: function that computes the result from the input and args
+    :return: list of (version, start, prefixlen) tuples and list of errors
+    """
+    if store is not None and not isinstance(raw_input_from_web, str):
+        return _through_store_lines(store, action, raw_input_from_web, func, *args)
+    if store is None or len(raw_input_from_web) < store.min_size:
+        return func(raw_input_from_web, *args)
+    with metrics.timer("store"):
+        key = store.key(action, raw_input_from_web)
+        result = store.get(key)
+    if result is None:
+        result = func(raw_input_from_web, *args)
+        with metrics.timer("store"):
+            store.set(key, *result)
+    return result
+
+
+def _through_store_lines(store, action: str, lines: Iterable[str], func, *args) -> tuple:
+    """
+    Copies an iterable input to a temporary file while hashing it, then serves the result from the store
+    or computes it from the copy, so the input is never held in memory
+    :param store: result_store.ResultStore
+    :param action: name of the operation
+    :param lines: networks, one per line
+    :param func: function that computes the result from an iterable of lines and args
+    :return: list of (version, start, prefixlen) tuples and list of errors
+    """
+    size = 0
+    with tempfile.SpooledTemporaryFile(store.min_size, "w+", encoding="utf-8", errors="surrogatepass") as copy:
+        def copied() -> Iterator[str]:
+            nonlocal size
+            for line in lines:
+                copy.write(line if line.endswith("\n") else line + "\n")
+                size += len(line)
+                yield line
+
+        key = store.key(action, copied())
+        copy.seek(0)
+        if size < store.min_size:
+            return func(copy, *args)
+        with metrics.timer("store"):
+            result = store.get(key)
+        if result is None:
+            result = func(copy, *args)
+            with metrics.timer("store"):
+                store.set(key, *result)
+    return result
+
+
+def get_sorted_nets(raw_input_from_web: str | Iterable[str], store=None, workers: int | None = None) -> tuple:
+    """
+    Parses user networks, removes duplicates and sorts them, IPv4 first, then IPv6,
+    large string inputs are processed in parallel, iterable inputs are deduplicated chunk by chunk
+    :param raw_input_from_web: networks, one per line, as a string or an iterable of lines
+    :param store: result_store.ResultStore for large inputs that are submitted repeatedly, None - no store
+    :param workers: processes of the shared pool for string inputs of at least parallel_min_lines lines,
+    None - parallel_workers
+    :return: list of (version, start, prefixlen) tuples and list of errors
+    """
+    return _through_store(store, "sort", raw_input_from_web, _sorted_nets, workers)
+
+
+def _sorted_nets(raw_input_from_web: str | Iterable[str], workers: int | None = None) -> tuple:
+    parallel = _parallel(raw_input_from_web, _sorted_shard, False, workers)
+    if parallel is not None:
+        return parallel
+    if not isinstance(raw_input_from_web, str):
+        with metrics.timer("parse"):
+            user_nets, errors = _fold_lines(raw_input_from_web, _fold_unique, set(), False)
+        with metrics.timer("compute"):
+            return sorted(user_nets), errors
+    with metrics.timer("parse"):
+        lines = raw_input_from_web.splitlines()
+        metrics.observe_size("lines", len(lines))
+        user_nets, errors = _parse_nets(lines)
+    with metrics.timer("compute"):
+        if np_batch.use_numpy(len(user_nets)):
+            return np_batch.sort_unique_v4(user_nets) + sorted({net for net in user_nets if net[0] == 6}), errors
+        return sorted(set(user_nets)), errors
+
+
+def _merged_ranges(nets: Iterable[tuple]) -> Iterator[tuple]:
+    """
+    Merges consecutive networks that overlap or touch into address ranges
+    :param nets: sorted iterable of (version, start, prefixlen) tuples
+    :return: iterator of (version, first, last) tuples
+    """
+    version = first = last = None
+    for net_version, start, prefixlen in nets:
+        end = start + (1 << (_families[net_version] - prefixlen)) - 1
+        if net_version == version and start <= last + 1:
+            last = max(last, end)
+            continue
+        if version is not None:
+            yield version, first, last
+        version, first, last = net_version, start, end
+    if version is not None:
+        yield version, first, last
+
+
+def iter_out_form(nets: Iterable[tuple], form) -> Iterator[str]:
+    """
+    Lazily converts (version, start, prefixlen) tuples to strings in the format selected by the user,
+    the range format merges consecutive networks that overlap or touch into one "first - last" line
+    :param nets: iterable of (version, start, prefixlen) tuples
+    :param form: output format
+    :return: iterator of strings
+    """
     if form == "address":
-        return [str(net.network_address) for net in nets]
-    elif form == "address_prefix":
-        return [str(net) for net in nets]
+        return (_address_str(version, start) for version, start, prefixlen in nets)
     elif form == "address_mask":
-        return [f"{net.network_address} {net.netmask}" for net in nets]
+        return (f"{_address_str(version, start)} {_netmask_strs[version][prefixlen][0]}"
+                for version, start, prefixlen in nets)
     elif form == "address_wildcard":
-        return [f"{net.network_address} {net.hostmask}" for net in nets]
+        return (f"{_address_str(version, start)} {_netmask_strs[version][prefixlen][1]}"
+                for version, start, prefixlen in nets)
+    elif form == "range":
+        return (f"{_address_str(version, first)} - {_address_str(version, last)}"
+                for version, first, last in _merged_ranges(nets))
     else:
-        return [str(net) for net in nets]
+        return (f"{_address_str(version, start)}/{prefixlen}" for version, start, prefixlen in nets)
 
 
-def sum_nets(raw_input_from_web: str, dirty=0):
-    sorted_nets, errors = get_sorted_nets(raw_input_from_web)
+def get_out_form(nets: list, form) -> list:
+    """
+    Converts (version, start, prefixlen) tuples to strings in the format selected by the user
+    :param nets: list of (version, start, prefixlen) tuples
+    :param form: output format
+    :return: list of strings
+    """
+    return list(iter_out_form(nets, form))
 
-    current_index = 0
-    while current_index < (len(sorted_nets) - 1):
-        one = sorted_nets[current_index]
-        two = sorted_nets[current_index + 1]
 
-        if one.prefixlen != two.prefixlen:
-            if one.supernet_of(two):
-                sorted_nets.remove(two)
-            elif two.supernet_of(one):
-                sorted_nets.remove(one)
-            else:
-                current_index += 1
+def range_to_cidrs(first: int, last: int, max_len: int) -> Iterator[tuple[int, int]]:
+    """
+    Decomposes an address range into the minimal list of networks
+    :param first: first address of the range
+    :param last: last address of the range
+    :param max_len: bit length of the address family, 32 or 128
+    :return: iterator of (start, prefixlen) pairs
+    """
+    while first <= last:
+        # the largest block aligned on first that does not go past last
+        size_bits = (last - first + 1).bit_length() - 1
+        if first:
+            aligned_bits = (first & -first).bit_length() - 1
+            if aligned_bits < size_bits:
+                size_bits = aligned_bits
+        yield first, max_len - size_bits
+        first += 1 << size_bits
+
+
+def _collapse(pairs: list, max_len: int) -> list:
+    """
+    Collapses adjacent and contained networks of one address family in a single pass
+    :param pairs: list of (start, prefixlen) integer pairs sorted by start, then prefixlen
+    :param max_len: bit length of the address family, 32 or 128
+    :return: minimal list of (start, prefixlen) pairs covering the same addresses
+    """
+    stack = []
+    last_end = -1
+    for start, prefixlen in pairs:
+        if start <= last_end:
+            # contained in the network on top of the stack
+            continue
+        last_end = start + (1 << (max_len - prefixlen)) - 1
+        # merge sibling halves while the two networks on top can form their supernet
+        while stack:
+            top_start, top_len = stack[-1]
+            if top_len != prefixlen or prefixlen == 0:
+                break
+            size = 1 << (max_len - prefixlen)
+            if top_start + size != start or top_start & ((size << 1) - 1):
+                break
+            stack.pop()
+            start, prefixlen = top_start, prefixlen - 1
+        stack.append((start, prefixlen))
+    return stack
+
+
+def _sum(user_nets: list[tuple], ranges: list[tuple]) -> list[tuple]:
+    """
+    Collapses networks and address ranges into the minimal list of networks
+    :param user_nets: list of (version, start, prefixlen) tuples
+    :param ranges: list of (version, first, last) tuples
+    :return: sorted list of (version, start, prefixlen) tuples
+    """
+    summed_nets = []
+    if ranges:
+        # ranges are merged as intervals, so they are decomposed into networks only once, after merging
+        for version, max_len in _families.items():
+            pairs = [(first, last) for net_version, first, last in ranges if net_version == version]
+            pairs.extend((start, start + (1 << (max_len - prefixlen)) - 1)
+                         for net_version, start, prefixlen in user_nets if net_version == version)
+            pairs.sort()
+            summed_nets.extend((version, *pair) for first, last in _merge_intervals(pairs)
+                               for pair in range_to_cidrs(first, last, max_len))
+        return summed_nets
+    if np_batch.use_numpy(len(user_nets)):
+        summed_nets = np_batch.collapse_v4(user_nets)
+        user_nets = [net for net in user_nets if net[0] == 6]
+    sorted_nets = sorted(set(user_nets))
+    for version, max_len in _families.items():
+        pairs = [(start, prefixlen) for net_version, start, prefixlen in sorted_nets if net_version == version]
+        summed_nets.extend((version, start, prefixlen) for start, prefixlen in _collapse(pairs, max_len))
+    return summed_nets
+
+
+def sum_nets(raw_input_from_web: str | Iterable[str], dirty=0, store=None, workers: int | None = None):
+    return _through_store(store, "sum", raw_input_from_web, _summed_nets, workers)
+
+
+def _summed_nets(raw_input_from_web: str | Iterable[str], workers: int | None = None) -> tuple:
+    parallel = _parallel(raw_input_from_web, _summed_shard, True, workers)
+    if parallel is not None:
+        return parallel
+    if not isinstance(raw_input_from_web, str):
+        # chunks are summed as they are parsed, so the timings are not split into parse and compute
+        with metrics.timer("compute"):
+            return _fold_lines(raw_input_from_web, _fold_sum, [], True)
+    ranges = []
+    with metrics.timer("parse"):
+        lines = raw_input_from_web.splitlines()
+        metrics.observe_size("lines", len(lines))
+        user_nets, errors = _parse_nets(lines, ranges)
+
+    with metrics.timer("compute"):
+        summed_nets = _sum(user_nets, ranges)
+
+    return summed_nets, errors
+
+
+def _merge_intervals(pairs: Iterable[tuple[int, int]]) -> list[list[int]]:
+    """
+    Merges sorted address ranges that overlap or touch
+    :param pairs: iterable of (first, last) pairs sorted by first
+    :return: sorted list of non-overlapping [first, last] ranges
+    """
+    ranges = []
+    for start, last in pairs:
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], last)
         else:
-            if one.supernet().supernet_of(two):
-                sorted_nets.remove(one)
-                sorted_nets.remove(two)
-                sorted_nets.append(one.supernet())
-                sorted_nets.sort()
-                if current_index != 0:
-                    current_index -= 1
-            else:
-                current_index += 1
+            ranges.append([start, last])
+    return ranges
 
-    return sorted_nets, errors
+
+def _intervals(nets: Iterable[tuple], version: int) -> list[list[int]]:
+    """
+    Merges sorted networks of one address family into non-overlapping address ranges
+    :param nets: sorted iterable of (version, start, prefixlen) tuples
+    :param version: 4 or 6
+    :return: sorted list of [first, last] ranges
+    """
+    max_len = _families[version]
+    return _merge_intervals((start, start + (1 << (max_len - prefixlen)) - 1)
+                            for net_version, start, prefixlen in nets if net_version == version)
+
+
+def _intersect(one: list[list[int]], two: list[list[int]]) -> list[list[int]]:
+    """
+    Intersection of two sorted lists of non-overlapping ranges in a single merge pass
+    """
+    result = []
+    i = j = 0
+    while i < len(one) and j < len(two):
+        first = max(one[i][0], two[j][0])
+        last = min(one[i][1], two[j][1])
+        if first <= last:
+            result.append([first, last])
+        if one[i][1] < two[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def _subtract(one: list[list[int]], two: list[list[int]]) -> list[list[int]]:
+    """
+    Ranges of one that are not covered by two, both sorted and non-overlapping, in a single merge pass
+    """
+    result = []
+    j = 0
+    for first, last in one:
+        while j < len(two) and two[j][1] < first:
+            j += 1
+        k = j
+        while k < len(two) and two[k][0] <= last:
+            if two[k][0] > first:
+                result.append([first, two[k][0] - 1])
+            first = max(first, two[k][1] + 1)
+            k += 1
+        if first <= last:
+            result.append([first, last])
+    return result
+
+
+def set_operation(action: str, raw_input_from_web: str | Iterable[str],
+                  raw_other_from_web: str | Iterable[str] = "") -> tuple:
+    """
+    Set operations on network lists, the result is the minimal list of networks
+    union - networks covered by either list, intersection - covered by both lists,
+    difference - covered by the first list and not by the second, complement - not covered by the first list
+    :param action: union, intersection, difference or complement
+    :param raw_input_from_web: first list of networks, one per line
+    :param raw_other_from_web: second list of networks, one per line
+    :return: list of (version, start, prefixlen) tuples and list of errors
+    """
+    nets, errors = get_sorted_nets(raw_input_from_web)
+    other_nets, other_errors = get_sorted_nets(raw_other_from_web)
+    errors.extend(other_errors)
+
+    with metrics.timer("compute"):
+        result = []
+        for version, max_len in _families.items():
+            one = _intervals(nets, version)
+            two = _intervals(other_nets, version)
+            if action == "union":
+                ranges = _intervals(merge(nets, other_nets), version)
+            elif action == "intersection":
+                ranges = _intersect(one, two)
+            elif action == "difference":
+                ranges = _subtract(one, two)
+            elif action == "complement":
+                ranges = _subtract([[0, (1 << max_len) - 1]], one) if one else []
+            else:
+                raise ValueError(f"Unknown action {action}")
+            result.extend((version, *pair) for first, last in ranges for pair in range_to_cidrs(first, last, max_len))
+    return result, errors
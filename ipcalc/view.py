@@ -1,18 +1,144 @@
+import hashlib
+import io
+import json
 import logging
+import secrets
 
 from flask.views import View
-from flask import request, render_template, jsonify
+from flask import (abort, request, render_template, stream_template, jsonify, make_response, Response,
+                   stream_with_context)
 
 from ip_calc_app import application
-from calculator import calc_dispatcher
-from gen_pass import generate_passwords
-from sort_sum import get_sorted_nets, sum_nets, get_out_form
+import metrics
+from cache import LRUCache
+from calculator import calc_dispatcher, calc_result, calc_bulk, calc_key, subnets_limit, calc_cache
+from workers import offload
 
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 
+def _network_count(index) -> int:
+    """
+    :return: weight of a loaded network list in the caches, the number of its networks
+    """
+    return 1 + index.size
+
+
+# loaded lists stay in this process, see asgi.py for deployments with several server workers
+trie_indexes = LRUCache(maxsize=2000000, ttl=3600, weigh=_network_count)  # networks of all lists, about 600 MB
+aggregators = LRUCache(maxsize=2000000, ttl=3600, weigh=_network_count)  # networks of all sessions, about 450 MB
+page_cache = LRUCache(maxsize=256, ttl=3600)
+
+metrics.enabled = application.config["METRICS"]
+
+result_store = None
+if application.config["RESULT_STORE_DIR"]:
+    from result_store import ResultStore
+
+    result_store = ResultStore(application.config["RESULT_STORE_DIR"], application.config["RESULT_STORE_MAX_BYTES"])
+
+
+@application.before_request
+def start_timings():
+    if metrics.enabled:
+        metrics.start_request()
+
+
+@application.after_request
+def add_server_timing(response):
+    if metrics.enabled:
+        timing = metrics.server_timing()
+        if timing:
+            response.headers["Server-Timing"] = timing
+    return response
+
+
+def _calc_etag(*parts) -> str:
+    """
+    Strong ETag of a calculator response, derived from the normalized query and the application version
+    :param parts: raw request string followed by the other request arguments
+    :return: str
+    """
+    try:
+        key = calc_key(*parts)
+    except (ValueError, TypeError):
+        key = parts
+    return hashlib.sha256(repr((application.version, key)).encode()).hexdigest()[:32]
+
+
+def _is_heavy_calc(key: tuple) -> bool:
+    """
+    :param key: result of calc_key
+    :return: True if the request lists more subnets than HEAVY_SUBNETS
+    """
+    addr, network, sub_pfx, offset, limit, fields, compressed = key
+    if sub_pfx is None:
+        return False
+    rows = min(limit, (1 << max(sub_pfx - network.prefixlen, 0)) - offset)
+    return rows > application.config["HEAVY_SUBNETS"]
+
+
+def _compute_calc(key: tuple) -> dict:
+    """
+    calc_result that runs large subnet listings in the process pool
+    """
+    if _is_heavy_calc(key):
+        return offload(application.config["CPU_WORKERS"], calc_result, key)
+    return calc_result(key)
+
+
+def _calc(*parts) -> dict:
+    """
+    calc_dispatcher that runs large subnet listings in the process pool, results are cached in this process
+    """
+    return calc_dispatcher(*parts, compute=_compute_calc)
+
+
+def _nets_from_text(func, raw_user_nets: str) -> tuple:
+    """
+    Runs sort_sum.get_sorted_nets or sort_sum.sum_nets with the result store. Lists of at least parallel_min_lines
+    lines stay in this process and their pieces are parsed in the process pool, other lists longer than HEAVY_LINES
+    are sent to the pool whole, shorter lists are processed in the request worker
+    :param func: get_sorted_nets or sum_nets
+    :param raw_user_nets: networks, one per line
+    :return: list of (version, start, prefixlen) tuples and list of errors
+    """
+    import sort_sum
+
+    workers = application.config["CPU_WORKERS"]
+    lines = raw_user_nets.count("\n")
+    if workers > 1 and lines >= sort_sum.parallel_min_lines:
+        return func(raw_user_nets, store=result_store, workers=workers)
+    if lines <= application.config["HEAVY_LINES"]:
+        workers = 0
+    return offload(workers, func, raw_user_nets, store=result_store)
+
+
+def _jsonify_timed(context: dict):
+    with metrics.timer("serialize"):
+        return jsonify(context)
+
+
+def _conditional_response(etag: str, make_body):
+    """
+    Returns 304 if the client already has this ETag, otherwise builds the response,
+    both are cacheable by browsers and reverse proxies
+    :param etag: ETag of the response
+    :param make_body: function without arguments that returns the response body
+    :return: Response
+    """
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = make_response(make_body())
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = application.config["CACHE_MAX_AGE"]
+    return response
+
+
 class IPCalc(View):
     init_every_request = False
 
@@ -20,14 +146,30 @@ class IPCalc(View):
         self.template = template
 
     def dispatch_request(self):
-        context = {"version": application.version}
         raw_request_string = request.args.get('network', '')
-        if raw_request_string:
-            context = calc_dispatcher(raw_request_string)
-            application.logger.debug(f"{raw_request_string=}")
-            application.logger.debug(f"{context=}")
-
-        return render_template(self.template, **context)
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', application.config["HTML_SUBNETS_PAGE"], type=int)
+        # the page echoes the raw request string, so it is a part of the ETag
+        etag = (_calc_etag(raw_request_string, offset, limit)
+                + hashlib.sha256(raw_request_string.encode()).hexdigest()[:8])
+
+        def render():
+            page = page_cache.get((self.template, etag))
+            if page is None:
+                context = {"version": application.version}
+                if raw_request_string:
+                    context = _calc(raw_request_string, offset, limit)
+                    application.logger.debug(f"{raw_request_string=}")
+                    application.logger.debug(f"{context=}")
+                if len(context.get("subnets", ())) > application.config["HTML_SUBNETS_PAGE"]:
+                    # large subnet tables are streamed and are not kept in the page cache
+                    return Response(stream_template(self.template, **context))
+                with metrics.timer("render"):
+                    page = render_template(self.template, **context)
+                page_cache.set((self.template, etag), page)
+            return page
+
+        return _conditional_response(etag, render)
 
 
 class GenPass(View):
@@ -37,11 +179,20 @@ class GenPass(View):
         self.template = template
 
     def dispatch_request(self):
+        from gen_pass import generate_passwords  # imported on first use to keep worker startup fast
+
         context = {}
         if request.args:
-            context = generate_passwords(**request.args)
+            args = request.args.to_dict()
+            length = request.args.get('length', 16, type=int)
+            quantity = request.args.get('quantity', 8, type=int)
+            if length * quantity > application.config["HEAVY_PASSWORD_CHARS"]:
+                context = offload(application.config["CPU_WORKERS"], generate_passwords, **args)
+            else:
+                context = generate_passwords(**args)
 
-        return render_template(self.template, **context)
+        with metrics.timer("render"):
+            return render_template(self.template, **context)
 
 
 class SortSum(View):
@@ -53,27 +204,241 @@ class SortSum(View):
         self.template = template
 
     def dispatch_request(self):
+        from sort_sum import get_sorted_nets, sum_nets, get_out_form, set_operation
+
         context = {}
         if request.method == 'POST':
             out_form = request.form.get("output_format")
-            raw_user_nets = request.form.get("user_nets")
+            raw_user_nets = request.form.get("user_nets", "")
+            raw_other_nets = request.form.get("other_nets", "")
             user_nets = []
             errors = []
 
+            lines = raw_user_nets.count("\n") + raw_other_nets.count("\n")
+            workers = application.config["CPU_WORKERS"] if lines > application.config["HEAVY_LINES"] else 0
+
             if request.form['action'] == "sort":
-                user_nets, errors = get_sorted_nets(raw_user_nets)
+                user_nets, errors = _nets_from_text(get_sorted_nets, raw_user_nets)
 
             if request.form['action'] == "sum":
-                user_nets, errors = sum_nets(raw_user_nets)
+                user_nets, errors = _nets_from_text(sum_nets, raw_user_nets)
 
+            if request.form['action'] in ("union", "intersection", "difference", "complement"):
+                user_nets, errors = offload(workers, set_operation, request.form['action'],
+                                            raw_user_nets, raw_other_nets)
+
+            with metrics.timer("serialize"):
+                sorted_nets = get_out_form(user_nets, out_form)
             context = {
                 "user_nets": raw_user_nets,
-                "sorted_nets": get_out_form(user_nets, out_form),
+                "other_nets": raw_other_nets,
+                "sorted_nets": sorted_nets,
                 "errors": errors,
                 "output_format": out_form,
             }
 
-        return render_template(self.template, **context)
+        with metrics.timer("render"):
+            return render_template(self.template, **context)
+
+
+class SortSumStream(View):
+    """
+    Sorts or sums a network list sent as the request body, one network per line.
+    The body is parsed in chunks of lines that are deduplicated or summed right away, so memory follows
+    the size of the result, which is streamed back as text/plain or NDJSON
+    """
+    init_every_request = False
+
+    methods = ["POST"]
+
+    def dispatch_request(self):
+        from sort_sum import get_sorted_nets, sum_nets, iter_out_form
+
+        action = request.args.get("action", "sort")
+        out_form = request.args.get("output_format")
+        ndjson = request.args.get("format") == "ndjson"
+
+        lines = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace")
+        if action == "sum":
+            user_nets, errors = sum_nets(lines, store=result_store)
+        else:
+            user_nets, errors = get_sorted_nets(lines, store=result_store)
+
+        def generate():
+            for net in iter_out_form(user_nets, out_form):
+                yield json.dumps({"net": net}) + "\n" if ndjson else net + "\n"
+            for error in errors:
+                yield json.dumps({"error": str(error)}) + "\n" if ndjson else f"# error: {error}\n"
+
+        mimetype = "application/x-ndjson" if ndjson else "text/plain"
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+class BulkCalc(View):
+    """
+    Calculates many networks per request. The body is a JSON array of strings or one query per line,
+    results are streamed back in the same order as a JSON array or NDJSON respectively
+    """
+    init_every_request = False
+
+    methods = ["POST"]
+
+    def dispatch_request(self):
+        if request.is_json:
+            queries = request.get_json(silent=True)
+            if not isinstance(queries, list):
+                return jsonify({"net_error": "Request body must be a JSON array"}), 400
+        else:
+            lines = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace")
+            queries = [line for line in lines if line.strip()]
+        results = calc_bulk(queries, application.config["CPU_WORKERS"])
+
+        def generate_json():
+            yield "["
+            for index, result in enumerate(results):
+                yield ("," if index else "") + json.dumps(result)
+            yield "]\n"
+
+        def generate_ndjson():
+            for result in results:
+                yield json.dumps(result) + "\n"
+
+        if request.is_json:
+            return Response(generate_json(), mimetype="application/json")
+        return Response(generate_ndjson(), mimetype="application/x-ndjson")
+
+
+class TrieLoad(View):
+    """
+    Loads a network list, one network per line, into a prefix trie and returns its index id for lookups.
+    Large lists are parsed in the process pool, the trie stays in this process and is built in one pass
+    in the request worker, so lists longer than TRIE_MAX_NETWORKS are rejected.
+    Indexes exist only in the server worker that loaded them
+    """
+    init_every_request = False
+
+    methods = ["POST"]
+
+    def dispatch_request(self):
+        from prefix_trie import PrefixTrie
+        from sort_sum import get_sorted_nets
+
+        raw_user_nets = request.get_data()
+        index = hashlib.sha256(raw_user_nets).hexdigest()[:32]
+        trie = trie_indexes.get(index)
+        errors = []
+        if trie is None:
+            user_nets, errors = _nets_from_text(get_sorted_nets, raw_user_nets.decode("utf-8", errors="replace"))
+            max_networks = application.config["TRIE_MAX_NETWORKS"]
+            if len(user_nets) > max_networks:
+                return jsonify({"net_error": f"More than {max_networks} networks, split the list"}), 413
+            with metrics.timer("compute"):
+                trie = PrefixTrie(user_nets)
+            trie_indexes.set(index, trie)
+        return jsonify({"index": index, "networks": trie.size, "errors": [str(error) for error in errors]})
+
+
+class TrieLookup(View):
+    """
+    Answers lookups against a loaded network list:
+    match - longest-prefix match, contains - networks containing the query,
+    overlaps - networks overlapping the query, gaps - free space inside the query
+    """
+    init_every_request = False
+
+    operations = {
+        "match": lambda trie, net: [found] if (found := trie.longest_match(net)) else [],
+        "contains": lambda trie, net: trie.containing(net),
+        "overlaps": lambda trie, net: trie.overlapping(net),
+        "gaps": lambda trie, net: trie.gaps(net),
+    }
+
+    def dispatch_request(self, index, network):
+        from sort_sum import get_sorted_nets, get_out_form
+
+        trie = trie_indexes.get(index)
+        if trie is None:
+            return jsonify({"net_error": f"Unknown index {index}, load the network list again"}), 404
+        op = request.args.get("op", "match")
+        if op not in self.operations:
+            return jsonify({"net_error": f"Unknown operation {op}"}), 400
+        nets, errors = get_sorted_nets([network])
+        if errors:
+            return jsonify({"net_error": str(errors[0])}), 400
+        result = self.operations[op](trie, nets[0])
+        return jsonify({
+            "query": get_out_form(nets, "address_prefix")[0],
+            "op": op,
+            "result": get_out_form(result, request.args.get("output_format")),
+        })
+
+
+class AggregateLoad(View):
+    """
+    Loads a network list, one network per line, into an incremental aggregator and returns its session id.
+    Large lists are parsed in the process pool, the trie stays in this process and is built in the request worker
+    with the garbage collector paused, so lists longer than AGGREGATE_MAX_NETWORKS are rejected.
+    Sessions exist only in the server worker that loaded them
+    """
+    init_every_request = False
+
+    methods = ["POST"]
+
+    def dispatch_request(self):
+        from aggregator import Aggregator
+        from sort_sum import get_sorted_nets
+
+        user_nets, errors = _nets_from_text(get_sorted_nets, request.get_data().decode("utf-8", errors="replace"))
+        max_networks = application.config["AGGREGATE_MAX_NETWORKS"]
+        if len(user_nets) > max_networks:
+            return jsonify({"net_error": f"More than {max_networks} networks, split the list"}), 413
+        with metrics.timer("compute"):
+            aggregator = Aggregator(user_nets)
+        session = secrets.token_hex(16)
+        aggregators.set(session, aggregator)
+        return jsonify({
+            "session": session,
+            "networks": aggregator.size,
+            "summary_size": len(aggregator.summary()),
+            "errors": [str(error) for error in errors],
+        })
+
+
+class AggregateSession(View):
+    """
+    GET - the current summary of the session,
+    POST - a JSON object {"add": [...], "withdraw": [...]}, networks are withdrawn first,
+    the response lists only the summary networks that appeared and disappeared
+    """
+    init_every_request = False
+
+    methods = ["GET", "POST"]
+
+    def dispatch_request(self, session):
+        from sort_sum import get_sorted_nets, get_out_form
+
+        aggregator = aggregators.get(session)
+        if aggregator is None:
+            return jsonify({"net_error": f"Unknown session {session}, load the network list again"}), 404
+        out_form = request.args.get("output_format")
+        if request.method == "GET":
+            return jsonify({"networks": aggregator.size, "summary": get_out_form(aggregator.summary(), out_form)})
+        changes = request.get_json(silent=True)
+        if not isinstance(changes, dict) or not all(
+                isinstance(changes.get(name, []), list) for name in ("add", "withdraw")):
+            return jsonify({"net_error": 'Request body must be a JSON object {"add": [...], "withdraw": [...]}'}), 400
+        add, add_errors = get_sorted_nets([str(net) for net in changes.get("add", ())])
+        withdraw, withdraw_errors = get_sorted_nets([str(net) for net in changes.get("withdraw", ())])
+        with metrics.timer("compute"):
+            added, removed = aggregator.update(add, withdraw)
+        # stored again to weigh the session by its new size
+        aggregators.set(session, aggregator)
+        return jsonify({
+            "networks": aggregator.size,
+            "added": get_out_form(added, out_form),
+            "removed": get_out_form(removed, out_form),
+            "errors": [f"add {error}" for error in add_errors] + [f"withdraw {error}" for error in withdraw_errors],
+        })
 
 
 @application.route('/faq')
@@ -89,8 +454,24 @@ def about():
 @application.route('/api/<network>')
 def api(network):
     if network:
-        context = calc_dispatcher(network)
-        return jsonify(context)
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', subnets_limit, type=int)
+        fields = request.args.get('fields', type=lambda value: tuple(value.split(',')))
+        compressed = request.args.get('notation') == "compressed"
+        etag = _calc_etag(network, offset, limit, fields, compressed)
+        return _conditional_response(etag, lambda: _jsonify_timed(_calc(network, offset, limit, fields, compressed)))
+
+
+@application.route('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype="text/plain")
+
+
+@application.route('/api/cache_stats')
+def cache_stats():
+    return jsonify({**calc_cache.stats(), "pages": page_cache.stats()})
 
 
 @application.errorhandler(404)
@@ -106,3 +487,9 @@ def page_not_found(e):
 application.add_url_rule("/", view_func=IPCalc.as_view("ipcalc", "index.html"), )
 application.add_url_rule("/gen_pass", view_func=GenPass.as_view("gen_pass", "gen_pass.html"), )
 application.add_url_rule("/sort_sum", view_func=SortSum.as_view("sort_sum", "sort_sum.html"), )
+application.add_url_rule("/api/sort_sum", view_func=SortSumStream.as_view("sort_sum_stream"), )
+application.add_url_rule("/api/bulk", view_func=BulkCalc.as_view("bulk"), )
+application.add_url_rule("/api/trie", view_func=TrieLoad.as_view("trie_load"), )
+application.add_url_rule("/api/trie/<index>/<network>", view_func=TrieLookup.as_view("trie_lookup"), )
+application.add_url_rule("/api/aggregate", view_func=AggregateLoad.as_view("aggregate_load"), )
+application.add_url_rule("/api/aggregate/<session>", view_func=AggregateSession.as_view("aggregate_session"), )
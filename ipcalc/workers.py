@@ -0,0 +1,89 @@
+import logging
+import threading
+from typing import Iterator
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+_in_worker = False  # True in the pool processes, jobs they offload run inline instead of starting nested pools
+
+
+def _mark_worker() -> None:
+    global _in_worker
+    _in_worker = True
+
+
+def _get_pool(workers: int) -> "ProcessPoolExecutor":
+    """
+    Creates the process pool on first use, at most workers * 2 jobs are queued at a time
+    :param workers: number of worker processes
+    :return: ProcessPoolExecutor
+    """
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            _pool = ProcessPoolExecutor(workers, initializer=_mark_worker)
+            _slots = threading.BoundedSemaphore(workers * 2)
+            logger.debug(f"process pool started, {workers=}")
+        return _pool
+
+
+def offload(workers: int, func, *args, **kwargs):
+    """
+    Runs a CPU-heavy function in the bounded process pool and waits for the result,
+    the calling thread releases the GIL while waiting, so cheap requests are served meanwhile
+    :param workers: number of worker processes, 0 - run in the calling thread
+    :param func: picklable module level function
+    :return: result of func
+    """
+    if workers < 1 or _in_worker:
+        return func(*args, **kwargs)
+    pool = _get_pool(workers)
+    with _slots:
+        return pool.submit(func, *args, **kwargs).result()
+
+
+def _map_chunk(func, chunk: list) -> list:
+    return [func(item) for item in chunk]
+
+
+def offload_map(workers: int, func, items: list, chunksize: int = 1) -> Iterator:
+    """
+    Runs a CPU-heavy function for every item in the bounded process pool, every chunk of items takes one queue slot
+    :param workers: number of worker processes, 0 - run in the calling thread
+    :param func: picklable module level function of one argument
+    :param items: list of arguments
+    :param chunksize: number of items sent to a worker process at a time
+    :return: iterator of results in the order of items
+    """
+    if workers < 1 or _in_worker:
+        yield from map(func, items)
+        return
+    pool = _get_pool(workers)
+    futures = []
+    for start in range(0, len(items), chunksize):
+        _slots.acquire()
+        try:
+            future = pool.submit(_map_chunk, func, items[start:start + chunksize])
+        except BaseException:
+            _slots.release()
+            raise
+        future.add_done_callback(lambda _: _slots.release())
+        futures.append(future)
+    for future in futures:
+        yield from future.result()
+
+
+def shutdown() -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -1,4 +1,8 @@
 import os
+import random
+import string
+import subprocess
+import sys
 import pytest
 from pathlib import Path
 from ipaddress import ip_address, ip_network
@@ -47,12 +51,293 @@ def test_fill_network_type():
     assert calculator._fill_network_type(ip_network("FEC0::/10")) == "Site local"
 
 
+def test_classify_ranges():
+    nets = [ip_network(net) for net in (
+        "10.0.0.0/7", "100.64.0.0/10", "100.0.0.0/9", "192.0.0.168/29", "192.0.0.170/31", "0.0.0.0/0",
+        "255.255.255.255/32", "1.1.1.1/32",
+    )]
+    ranges = [(int(net.network_address), int(net.broadcast_address)) for net in nets]
+    assert calculator.classify_ranges(4, ranges) == ["Global", " ", "Global", "Global", "Private", "Global",
+                                                     "Reserved", "Global"]
+    assert calculator.classify_ranges(6, [(0, 2 ** 128 - 1), (0, 0), (1, 1)]) == ["Global", "Unspecified", "Loopback"]
+    assert calculator._fill_network_type(ip_address("::ffff:10.0.0.1")) == "Reserved"
+    assert calculator._fill_network_type(ip_network("fe00::/9")) == "Reserved"
+    page = calculator._find_subnets(ip_network("100.0.0.0/8"), 10)
+    assert [subnet["type"] for subnet in page["subnets"]] == ["Global", " ", "Global", "Global"]
+
+
 def test_fill_v4_class():
     assert calculator._fill_v4_class(ip_address("10.0.0.0").packed) == "Class A"
     assert calculator._fill_v4_class(ip_address("172.16.0.0").packed) == "Class B"
     assert calculator._fill_v4_class(ip_address("192.168.0.0").packed) == "Class C"
     assert calculator._fill_v4_class(ip_address("224.0.0.0").packed) == "Class D"
     assert calculator._fill_v4_class(ip_address("240.0.0.0").packed) == "Class E"
+    assert calculator._fill_v4_class(ip_address("127.255.255.255").packed) == "Class A"
+    assert calculator._fill_v4_class(ip_address("191.255.0.0").packed) == "Class B"
+    assert calculator._fill_v4_class(ip_address("255.255.255.255").packed) == "Class E"
+
+
+def test_v4_masks():
+    for prefixlen in range(33):
+        netw = ip_network(f"0.0.0.0/{prefixlen}")
+        assert calculator._v4_masks[prefixlen] == (
+            str(netw.netmask), calculator._get_doted_binary(netw.netmask.packed),
+            str(netw.hostmask), calculator._get_doted_binary(netw.hostmask.packed),
+        )
+
+
+def test_sum_nets():
+    summed, errors = sort_sum.sum_nets("10.0.0.0/24\n10.0.1.0/25\n10.0.1.128/25\n10.0.0.5/32\n10.0.3.0/24")
+    assert sort_sum.get_out_form(summed, "address_prefix") == ["10.0.0.0/23", "10.0.3.0/24"]
+    assert errors == []
+
+
+def test_sum_nets_mixed_versions():
+    summed, errors = sort_sum.sum_nets("2001:db8::/33\n10.0.0.0/25\n2001:db8:8000::/33\n10.0.0.128/25")
+    assert sort_sum.get_out_form(summed, "address_prefix") == ["10.0.0.0/24", "2001:db8::/32"]
+
+
+def test_non_ascii_digits():
+    nets, errors = sort_sum.get_sorted_nets("10.0.0.0/8\n10.0.0.0/\u0668\n\u0661\u0660.0.0.0/8\n2001:db8::/\u06632")
+    assert sort_sum.get_out_form(nets, "address_prefix") == ["10.0.0.0/8"]
+    assert len(errors) == 3
+    nets, errors = sort_sum.get_sorted_nets("10.0.0.0/8\nip mask\n")
+    assert len(nets) == 1 and list(map(str, errors)) == ["line 2: 'ip mask' does not contain an address"]
+
+
+def test_numpy_parity(monkeypatch):
+    pytest.importorskip("numpy")
+    rnd = random.Random(13)
+    raw = "\n".join(f"{ip_network((rnd.getrandbits(12) << 20, rnd.randint(12, 32)), strict=False)}"
+                    for _ in range(3000))
+    raw += "\n2001:db8::/33\n2001:db8:8000::/33\nbad"
+    monkeypatch.setattr(sort_sum.np_batch, "min_size", 10 ** 9)
+    expected = sort_sum.get_sorted_nets(raw)[0], sort_sum.sum_nets(raw)[0]
+    monkeypatch.setattr(sort_sum.np_batch, "min_size", 0)
+    assert (sort_sum.get_sorted_nets(raw)[0], sort_sum.sum_nets(raw)[0]) == expected
+
+
+def test_parallel_parity(monkeypatch):
+    rnd = random.Random(17)
+    lines = [f"{ip_network((rnd.getrandbits(12) << 20, rnd.randint(12, 32)), strict=False)}" for _ in range(2000)]
+    lines += ["2001:db8::/33", "bad", "", "10.0.0.1 - 10.0.0.77", "2001:db8:8000::/33", "10.0.0.9 - 10.0.0.1"]
+    rnd.shuffle(lines)
+    raw = "\r\n".join(lines)
+    expected = sort_sum.get_sorted_nets(raw), sort_sum.sum_nets(raw)
+    monkeypatch.setattr(sort_sum, "parallel_workers", 3)
+    monkeypatch.setattr(sort_sum, "parallel_min_lines", 100)
+    try:
+        result = sort_sum.get_sorted_nets(raw), sort_sum.sum_nets(raw)
+    finally:
+        workers.shutdown()
+    assert [nets for nets, _ in result] == [nets for nets, _ in expected]
+    assert [list(map(str, errors)) for _, errors in result] == [list(map(str, errors)) for _, errors in expected]
+    assert len(sort_sum._shards(raw, 12)) == 12
+
+
+def test_stream_chunks(monkeypatch):
+    rnd = random.Random(5)
+    lines = [f"{ip_network((rnd.getrandbits(12) << 20, rnd.randint(12, 32)), strict=False)}" for _ in range(3000)]
+    lines += ["2001:db8::/33", "bad", "", "10.0.0.1 - 10.0.0.77", "2001:db8:8000::/33"]
+    rnd.shuffle(lines)
+    monkeypatch.setattr(sort_sum, "stream_chunk_lines", 100)
+    for func in (sort_sum.get_sorted_nets, sort_sum.sum_nets):
+        nets, errors = func(iter(lines))
+        expected_nets, expected_errors = func("\n".join(lines))
+        assert nets == expected_nets and list(map(str, errors)) == list(map(str, expected_errors))
+    monkeypatch.setattr(sort_sum, "stream_max_errors", 2)
+    nets, errors = sort_sum.sum_nets(["10.0.0.0/25", "a", "b", "c", "d", "10.0.0.128/25"])
+    assert sort_sum.get_out_form(nets, "address_prefix") == ["10.0.0.0/24"]
+    assert list(map(str, errors)) == ["line 2: 'a' does not appear to be an IPv4 or IPv6 network",
+                                      "line 3: 'b' does not appear to be an IPv4 or IPv6 network",
+                                      "2 more errors are not shown"]
+
+def test_result_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store.ResultStore, "min_size", 0)
+    store = result_store.ResultStore(str(tmp_path), max_bytes=300)
+    raw = "10.0.0.0/25\r\n10.0.0.128/25\r\nbad\r\n2001:db8::/33\r\n2001:db8:8000::/33"
+    expected = sort_sum.sum_nets(raw)
+    result = sort_sum.sum_nets(raw, store=store)
+    assert result[0] == expected[0] and store.misses == 1
+    result = sort_sum.sum_nets(raw.replace("\r\n", "\n"), store=store)
+    assert result[0] == expected[0] and list(map(str, result[1])) == list(map(str, expected[1]))
+    assert store.hits == 1
+    result = sort_sum.sum_nets(iter(raw.splitlines(keepends=True)), store=store)
+    assert result[0] == expected[0] and list(map(str, result[1])) == list(map(str, expected[1]))
+    assert store.hits == 2
+    assert sort_sum.get_sorted_nets(raw, store=store)[0] == sort_sum.get_sorted_nets(raw)[0]
+    assert len(list(tmp_path.glob("*.bin"))) == 2
+    sort_sum.sum_nets("\n".join(f"10.{octet}.0.0/16" for octet in range(0, 20, 2)), store=store)
+    assert store.evictions == 1 and len(list(tmp_path.glob("*.bin"))) == 2
+    assert store.get(store.key("sum", raw)) is None
+    key = store.key("sort", raw)
+    monkeypatch.setattr(result_store, "format_version", result_store.format_version + 1)
+    assert store.key("sort", raw) != key
+    path = next(tmp_path.glob("*.bin"))
+    path.write_bytes(b"garbage")
+    assert store.get(path.stem) is None and not path.exists()
+
+
+def test_aggregator():
+    nets, _ = sort_sum.get_sorted_nets("10.0.0.0/24\n10.0.1.0/25\n10.0.1.192/26\n10.0.1.0/26\n2001:db8::/33")
+    agg = aggregator.Aggregator(nets)
+    assert agg.summary() == sort_sum.sum_nets("\n".join(sort_sum.get_out_form(nets, None)))[0]
+    added, removed = agg.add((4, 167772544, 26))  # 10.0.1.128/26
+    assert sort_sum.get_out_form(added, None) == ["10.0.0.0/23"]
+    assert sort_sum.get_out_form(removed, None) == ["10.0.0.0/24", "10.0.1.0/25", "10.0.1.192/26"]
+    assert agg.add((4, 167772544, 26)) == ([], [])
+    assert agg.add((4, 167772160, 25)) == ([], [])  # 10.0.0.0/25 is inside 10.0.0.0/24
+    added, removed = agg.withdraw((4, 167772160, 24))
+    assert sort_sum.get_out_form(added, None) == ["10.0.0.0/25", "10.0.1.0/24"]
+    assert sort_sum.get_out_form(removed, None) == ["10.0.0.0/23"]
+    rnd = random.Random(5)
+    nets = [(4, rnd.getrandbits(10) << 22 >> (32 - p) << (32 - p), p) for p in (rnd.randint(4, 12) for _ in range(300))]
+    agg = aggregator.Aggregator()
+    summary = set()
+    for operation, net in [(agg.add, net) for net in nets] + [(agg.withdraw, net) for net in nets[::3]]:
+        added, removed = operation(net)
+        assert set(removed) <= summary
+        summary = (summary - set(removed)) | set(added)
+    remaining = set(nets) - set(nets[::3])
+    assert sorted(summary) == agg.summary() == sort_sum.sum_nets(sort_sum.get_out_form(remaining, None))[0]
+
+
+def test_set_operation():
+    one = "10.0.0.0/8\n2001:db8::/32"
+    two = "10.1.0.0/16\n10.0.0.0/16\n11.0.0.0/8"
+    assert sort_sum.get_out_form(sort_sum.set_operation("union", one, two)[0], None) == [
+        "10.0.0.0/7", "2001:db8::/32"]
+    assert sort_sum.get_out_form(sort_sum.set_operation("intersection", one, two)[0], None) == ["10.0.0.0/15"]
+    assert sort_sum.get_out_form(sort_sum.set_operation("difference", one, two)[0], None) == [
+        "10.2.0.0/15", "10.4.0.0/14", "10.8.0.0/13", "10.16.0.0/12", "10.32.0.0/11", "10.64.0.0/10", "10.128.0.0/9",
+        "2001:db8::/32"]
+    assert sort_sum.get_out_form(sort_sum.set_operation("complement", "128.0.0.0/1\n0.0.0.0/2")[0], None) == [
+        "64.0.0.0/2"]
+
+
+def test_parse_nets():
+    nets, errors = sort_sum._parse_nets(
+        "10.1.2.3 255.255.0.0\n\nip address 10.1.2.3 mask 0.0.0.255\n10.0.0.01/8\nFE80::1%64\n10.1.2.3/33\n1.2.3.4_0")
+    assert sort_sum.get_out_form(nets, None) == ["10.1.0.0/16", "10.1.2.0/24", "fe80::/64", "0.0.0.0/0"]
+    assert [str(error).split(":")[0] for error in errors] == ["line 4", "line 6"]
+
+
+def test_get_out_form():
+    nets, errors = sort_sum.get_sorted_nets("10.1.2.3/24\n10.1.2.0 255.255.255.0\n2001:db8::1/64\n1.1.1.1")
+    assert nets == [(4, 16843009, 32), (4, 167838208, 24), (6, 42540766411282592856903984951653826560, 64)]
+    assert sort_sum.get_out_form(nets, "address") == ["1.1.1.1", "10.1.2.0", "2001:db8::"]
+    assert sort_sum.get_out_form(nets, "address_mask") == [
+        "1.1.1.1 255.255.255.255", "10.1.2.0 255.255.255.0", "2001:db8:: ffff:ffff:ffff:ffff::"]
+    assert sort_sum.get_out_form(nets, "address_wildcard") == [
+        "1.1.1.1 0.0.0.0", "10.1.2.0 0.0.0.255", "2001:db8:: ::ffff:ffff:ffff:ffff"]
+
+
+def test_range_input_and_output():
+    nets, errors = sort_sum._parse_nets(
+        "10.0.0.1 - 10.0.0.6\n2001:db8::-2001:db8::1:ffff\n10.0.0.9 - 10.0.0.8\n10.0.0.1 - ::1")
+    assert sort_sum.get_out_form(nets, None) == [
+        "10.0.0.1/32", "10.0.0.2/31", "10.0.0.4/31", "10.0.0.6/32", "2001:db8::/111"]
+    assert [str(error).split(":")[0] for error in errors] == ["line 3", "line 4"]
+    summed, errors = sort_sum.sum_nets("10.0.0.1 - 10.0.0.14\n10.0.0.15\n10.0.0.0/32\n10.0.1.0/24\n2001:db8::/64")
+    assert sort_sum.get_out_form(summed, None) == ["10.0.0.0/28", "10.0.1.0/24", "2001:db8::/64"]
+    assert sort_sum.get_out_form(summed, "range") == [
+        "10.0.0.0 - 10.0.0.15", "10.0.1.0 - 10.0.1.255", "2001:db8:: - 2001:db8::ffff:ffff:ffff:ffff"]
+    assert list(sort_sum.range_to_cidrs(0, 2 ** 128 - 1, 128)) == [(0, 0)]
+
+
+def test_find_subnets_paging():
+    result = calculator.calc_dispatcher("10.0.0.0/8 /30", offset=5, limit=3)
+    assert result["num_subnets"] == 4194304
+    assert [subnet["network_dd"] for subnet in result["subnets"]] == ["10.0.0.20/30", "10.0.0.24/30", "10.0.0.28/30"]
+    result = calculator.calc_dispatcher("2001:db8::/32 /128", offset=2 ** 96 - 1)
+    assert [subnet["network_hex"] for subnet in result["subnets"]] == ["2001:0db8:ffff:ffff:ffff:ffff:ffff:ffff/128"]
+    assert "net_error" in calculator.calc_dispatcher("10.0.0.0/24 /33")
+
+
+def test_calc_cache():
+    calculator.calc_cache.clear()
+    hits = calculator.calc_cache.hits
+    first = calculator.calc_dispatcher("10.0.0.0 255.0.0.0")
+    assert calculator.calc_dispatcher("10.0.0.0/8") is first
+    assert calculator.calc_cache.hits == hits + 1
+    assert calculator.calc_cache.stats()["size"] == 1
+    calculator.calc_dispatcher("10.0.0.0/8 /30", limit=8)
+    assert calculator.calc_cache.stats()["weight"] == 1 + 1 + 8
+
+    lru = cache.LRUCache(maxsize=2, ttl=0)
+    lru.set("a", 1)
+    assert lru.get("a") is None
+    lru.ttl = 60
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    assert lru.get("b") is None and lru.get("a") == 1
+
+    lru = cache.LRUCache(maxsize=10, weigh=len)
+    lru.set("a", [0] * 4)
+    lru.set("b", [0] * 5)
+    lru.set("c", [0] * 11)
+    assert lru.get("c") is None and lru.stats()["weight"] == 9
+    lru.set("c", [0] * 3)
+    assert lru.get("a") is None and lru.get("b") and lru.stats()["weight"] == 8
+
+
+def test_generate_passwords():
+    result = gen_pass.generate_passwords(nums="on", lchar="on", uchar="on", special="on", lstart="on",
+                                         length="4", quantity="512", exclude="abcdefghijklmnopqrstuvwxy")
+    assert len(result["passwords"]) == 512
+    for password in result["passwords"]:
+        assert len(password) == 4 and password[0].isalpha()
+        assert any(c.isdigit() for c in password) and any(c.isupper() for c in password)
+        assert "z" in password and any(c in string.punctuation for c in password)
+    assert "pass_error" in gen_pass.generate_passwords(nums="on", lchar="on", exclude="0123456789")
+    assert "pass_error" in gen_pass.generate_passwords()
+
+
+def test_prefix_trie():
+    nets, _ = sort_sum.get_sorted_nets("10.0.0.0/8\n10.1.0.0/16\n10.1.2.0/24\n10.1.128.0/17\n2001:db8::/32")
+    trie = prefix_trie.PrefixTrie(nets)
+    assert trie.size == 5
+    query, _ = sort_sum.get_sorted_nets("10.1.2.3")
+    assert sort_sum.get_out_form([trie.longest_match(query[0])], None) == ["10.1.2.0/24"]
+    assert sort_sum.get_out_form(trie.containing(query[0]), None) == ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"]
+    query, _ = sort_sum.get_sorted_nets("10.1.0.0/16")
+    assert sort_sum.get_out_form(trie.overlapping(query[0]), None) == [
+        "10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.1.128.0/17"]
+    query, _ = sort_sum.get_sorted_nets("10.1.0.0/16")
+    assert trie.gaps(query[0]) == []
+    query, _ = sort_sum.get_sorted_nets("11.0.0.0/8")
+    assert trie.longest_match(query[0]) is None
+    trie = prefix_trie.PrefixTrie(nets[2:])
+    query, _ = sort_sum.get_sorted_nets("10.1.0.0/16")
+    assert sort_sum.get_out_form(trie.gaps(query[0]), None) == [
+        "10.1.0.0/23", "10.1.3.0/24", "10.1.4.0/22", "10.1.8.0/21", "10.1.16.0/20", "10.1.32.0/19", "10.1.64.0/18"]
+
+    rnd = random.Random(11)
+    nets = [(4, rnd.getrandbits(16) << 16 >> (32 - prefixlen) << (32 - prefixlen), prefixlen)
+            for prefixlen in (rnd.randint(0, 16) for _ in range(500))]
+    built = prefix_trie.PrefixTrie(nets)
+    added = prefix_trie.PrefixTrie()
+    for net in reversed(nets):
+        added.add(net)
+    assert built.size == added.size and built.overlapping((4, 0, 0)) == added.overlapping((4, 0, 0))
+    for net in nets[:100]:
+        assert built.containing(net) == added.containing(net) and built.gaps(net) == added.gaps(net)
+
+
+IMPORT_TIME_BUDGET = 1.5  # seconds for a worker to import the application
+
+
+def test_import_time_budget():
+    src_dir = Path(__file__).resolve().parent.parent / "ipcalc"
+    code = ("import sys, time; start = time.perf_counter(); import view; "
+            "print(time.perf_counter() - start); "
+            "print(','.join(m for m in ('numpy', 'gen_pass', 'sort_sum', 'prefix_trie') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=src_dir, capture_output=True, text=True, check=True)
+    import_time, lazy_loaded = output.stdout.splitlines()
+    assert float(import_time) < IMPORT_TIME_BUDGET
+    assert lazy_loaded == ""
 
 
 @pytest.fixture
@@ -166,6 +451,170 @@ def test_api(client):
            ) in rv.data
 
 
+def test_api_sort_sum_stream(client):
+    body = b"10.0.1.0/24\n10.0.0.0/24\n\nbad\n10.0.0.0/24\n"
+    rv = client.post('/api/sort_sum?action=sort&output_format=address_mask', data=body)
+    assert rv.mimetype == "text/plain"
+    assert rv.data.startswith(b"10.0.0.0 255.255.255.0\n10.0.1.0 255.255.255.0\n# error: ")
+    rv = client.post('/api/sort_sum?action=sum&format=ndjson', data=body)
+    assert rv.mimetype == "application/x-ndjson"
+    assert rv.data.splitlines()[0] == b'{"net": "10.0.0.0/23"}'
+    assert rv.data.splitlines()[1].startswith(b'{"error": ')
+
+
+def test_api_subnets_paging(client):
+    rv = client.get('/api/10.0.0.0_8_30?offset=4&limit=2')
+    assert rv.json["num_subnets"] == 4194304
+    assert [subnet["network_dd"] for subnet in rv.json["subnets"]] == ["10.0.0.16/30", "10.0.0.20/30"]
+    rv = client.get('/?network=10.0.0.0/8+/30&offset=4&limit=2')
+    assert b'offset=6&amp;limit=2">next</a>' in rv.data
+    assert b'offset=2&amp;limit=2">previous</a>' in rv.data
+
+
+def test_api_bulk(client):
+    rv = client.post('/api/bulk', json=["10.0.0.0/8", "bad", "192.168.0.1/24 /25"])
+    assert [item.get("network_dd") for item in rv.json] == ["10.0.0.0/8", None, "192.168.0.0/24"]
+    assert "net_error" in rv.json[1]
+    assert rv.json[2]["num_subnets"] == 2
+    rv = client.post('/api/bulk', data="10.0.0.0/8\n\n2001:db8::/32\n")
+    assert rv.mimetype == "application/x-ndjson"
+    assert len(rv.data.splitlines()) == 2
+    rv = client.post('/api/bulk', json=["10.0.0.0/8", "ip", "mask"])
+    assert rv.status_code == 200 and rv.json[0]["network_dd"] == "10.0.0.0/8"
+    assert rv.json[1] == {"net_error": "'ip' does not contain an address"} and "net_error" in rv.json[2]
+    assert client.post('/api/bulk', json={"network": "10.0.0.0/8"}).status_code == 400
+
+
+def test_api_fields(client):
+    rv = client.get('/api/10.0.0.0_8_30?limit=2&fields=network_dd,hostmin_dd,hostmax_dd,hosts')
+    assert rv.json["subnets"] == [
+        {"network_dd": "10.0.0.0/30", "hostmin_dd": "10.0.0.1", "hostmax_dd": "10.0.0.2", "hosts": 2},
+        {"network_dd": "10.0.0.4/30", "hostmin_dd": "10.0.0.5", "hostmax_dd": "10.0.0.6", "hosts": 2},
+    ]
+    assert set(rv.json) == {
+        "network_dd", "hostmin_dd", "hostmax_dd", "hosts", "num_subnets", "subnets", "offset", "limit"}
+
+
+def test_api_v6_notation(client):
+    rv = client.get('/api/2001:db8::1_48_50?fields=network_hex,netmask_hex,hostmax_hex,hosts')
+    assert rv.json["network_hex"] == "2001:0db8:0000:0000:0000:0000:0000:0000/48"
+    assert rv.json["subnets"][3] == {
+        "network_hex": "2001:0db8:0000:c000:0000:0000:0000:0000/50",
+        "netmask_hex": "ffff:ffff:ffff:c000:0000:0000:0000:0000",
+        "hostmax_hex": "2001:0db8:0000:ffff:ffff:ffff:ffff:fffe",
+        "hosts": 2 ** 78 - 2,
+    }
+    rv = client.get('/api/2001:db8::1_48_50?notation=compressed')
+    assert rv.json["address"] == "2001:db8::1" and rv.json["wildcard_hex"] == "::ffff:ffff:ffff:ffff:ffff"
+    assert rv.json["subnets"][3]["network_hex"] == "2001:db8:0:c000::/50"
+    assert rv.json["subnets"][3]["broadcast_hex"] == "2001:db8:0:ffff:ffff:ffff:ffff:ffff"
+    assert client.get('/api/::ffff:1.2.3.4?notation=compressed').json["address"] == "::ffff:102:304"
+    assert client.get('/api/10.0.0.1?notation=compressed').json["address"] == "10.0.0.1"
+
+
+def test_api_trie(client, monkeypatch):
+    rv = client.post('/api/trie', data="10.1.0.0/16\n10.1.2.0/24\nbad\n")
+    assert rv.json["networks"] == 2 and len(rv.json["errors"]) == 1
+    index = rv.json["index"]
+    rv = client.get(f'/api/trie/{index}/10.1.2.3')
+    assert rv.json["result"] == ["10.1.2.0/24"]
+    rv = client.get(f'/api/trie/{index}/10.1.2.3?op=contains&output_format=address_mask')
+    assert rv.json["result"] == ["10.1.0.0 255.255.0.0", "10.1.2.0 255.255.255.0"]
+    rv = client.get(f'/api/trie/{index}/10.0.0.0_15?op=gaps')
+    assert rv.json["result"] == ["10.0.0.0/16"]
+    assert client.get('/api/trie/unknown/10.1.2.3').status_code == 404
+    monkeypatch.setitem(app.application.config, "TRIE_MAX_NETWORKS", 1)
+    assert client.post('/api/trie', data="10.0.0.0/25\n10.0.1.0/24\n").status_code == 413
+
+
+def test_api_aggregate(client, monkeypatch):
+    app.aggregators.clear()
+    rv = client.post('/api/aggregate', data="10.0.0.0/25\n10.0.1.0/24\nbad\n")
+    assert rv.json["networks"] == 2 and rv.json["summary_size"] == 2 and len(rv.json["errors"]) == 1
+    session = rv.json["session"]
+    rv = client.post(f'/api/aggregate/{session}', json={"add": ["10.0.0.128/25"], "withdraw": ["10.0.1.0/24", "x"]})
+    assert rv.json["added"] == ["10.0.0.0/24"]
+    assert rv.json["removed"] == ["10.0.0.0/25", "10.0.1.0/24"]
+    assert rv.json["networks"] == 2 and rv.json["errors"][0].startswith("withdraw line 2")
+    rv = client.get(f'/api/aggregate/{session}?output_format=address_mask')
+    assert rv.json["summary"] == ["10.0.0.0 255.255.255.0"]
+    assert client.post(f'/api/aggregate/{session}', json={"add": ["10.2.0.0/16"]}).json["networks"] == 3
+    assert app.aggregators.stats()["weight"] == 1 + 3
+    assert client.post(f'/api/aggregate/{session}', data="10.0.0.0/8").status_code == 400
+    assert client.post(f'/api/aggregate/{session}', json={"add": "10.0.0.0/8"}).status_code == 400
+    assert client.get('/api/aggregate/unknown').status_code == 404
+    monkeypatch.setitem(app.application.config, "AGGREGATE_MAX_NETWORKS", 1)
+    assert client.post('/api/aggregate', data="10.0.0.0/25\n10.0.1.0/24\n").status_code == 413
+
+
+def test_sort_sum_set_operation(client):
+    rv = client.post('/sort_sum', data={"action": "difference", "output_format": "address_prefix",
+                                         "user_nets": "10.0.0.0/23", "other_nets": "10.0.1.0/24"})
+    assert b'readonly>10.0.0.0/24\n' in rv.data
+
+
+def test_etag(client):
+    rv = client.get('/api/10.0.0.0_255.0.0.0')
+    assert rv.status_code == 200 and rv.cache_control.max_age == 86400
+    etag = rv.get_etag()[0]
+    rv = client.get('/api/10.0.0.0_8', headers={"If-None-Match": f'"{etag}"'})
+    assert rv.status_code == 304 and rv.data == b""
+    rv = client.get('/?network=10.0.0.0/8')
+    assert rv.status_code == 200
+    etag = rv.get_etag()[0]
+    assert client.get('/?network=10.0.0.0/8', headers={"If-None-Match": f'"{etag}"'}).status_code == 304
+    assert client.get('/?network=10.0.0.0 8', headers={"If-None-Match": f'"{etag}"'}).status_code == 200
+
+
+def test_offload_heavy(client, monkeypatch):
+    monkeypatch.setitem(app.application.config, "CPU_WORKERS", 1)
+    monkeypatch.setitem(app.application.config, "HEAVY_LINES", 0)
+    monkeypatch.setitem(app.application.config, "HEAVY_SUBNETS", 0)
+    try:
+        rv = client.post('/sort_sum', data={"action": "sum", "output_format": "address_prefix",
+                                             "user_nets": "10.0.0.0/24\n10.0.1.0/24"})
+        assert b'readonly>10.0.0.0/23\n' in rv.data
+        calculator.calc_cache.clear()
+        misses = calculator.calc_cache.misses
+        rv = client.get('/api/172.16.0.0_16_18?fields=network_dd')
+        assert [subnet["network_dd"] for subnet in rv.json["subnets"]][-1] == "172.16.192.0/18"
+        assert calculator.calc_cache.misses == misses + 1
+        assert calculator.calc_cache.stats()["size"] == 1
+        monkeypatch.setattr(calculator, "bulk_pool_threshold", 2)
+        rv = client.post('/api/bulk', json=["10.0.0.0/8", "bad", "192.168.0.1/24"])
+        assert [item.get("network_dd") for item in rv.json] == ["10.0.0.0/8", None, "192.168.0.0/24"]
+        monkeypatch.setitem(app.application.config, "CPU_WORKERS", 2)
+        monkeypatch.setattr(sort_sum, "parallel_min_lines", 1)
+        shard_calls = []
+        monkeypatch.setattr(sort_sum, "offload_map",
+                            lambda *args: shard_calls.append(args) or workers.offload_map(*args))
+        rv = client.post('/sort_sum', data={"action": "sum", "output_format": "address_prefix",
+                                             "user_nets": "10.0.0.0/24\n10.0.1.0/24\n10.0.2.0/23"})
+        assert b'readonly>10.0.0.0/22\n' in rv.data and len(shard_calls) == 1
+    finally:
+        workers.shutdown()
+
+
+def test_metrics(client, monkeypatch):
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setattr(metrics, "enabled", True)
+    rv = client.post('/sort_sum', data={"action": "sum", "output_format": "address_prefix",
+                                         "user_nets": "10.0.0.0/24\n10.0.1.0/24"})
+    assert [part.split(";")[0] for part in rv.headers["Server-Timing"].split(", ")] == [
+        "parse", "compute", "serialize", "render"]
+    rv = client.get('/metrics')
+    assert 'ipcalc_stage_seconds_count{stage="render"}' in rv.text
+    assert 'ipcalc_input_size_bucket{kind="lines",le="10"} ' in rv.text
+
+
+def test_subnet_table_pages(client):
+    rv = client.get('/?network=10.0.0.0/8+/20')
+    assert rv.data.count(b'<td class="col1">Network:</td>') == 257
+    assert b'offset=256&amp;limit=256">next</a>' in rv.data
+    rv = client.get('/?network=10.0.0.0/8+/20&limit=1024')
+    assert rv.is_streamed
+    assert rv.data.count(b'<td class="col1">Network:</td>') == 1025
+
+
 if __name__ == "__main__":
     pass
-